@@ -0,0 +1,233 @@
+# app/autotune.py
+"""Calibration sweep for llama.cpp runtime settings.
+
+Decode speed depends on n_threads, while prompt processing (prefill) depends on
+n_threads_batch and n_batch. The sweep measures the two phases separately on the
+real model, keeps the fastest setting for each, and caches the result per host
+and model file.
+
+    cd backend && python -m app.autotune --model app/models/llama-2-7b-chat.Q4_K_M.gguf
+"""
+import argparse
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import llama_cpp
+from llama_cpp import Llama
+
+# "off": defaults only, "cached": use a cached result if present,
+# "startup": use the cache or calibrate at startup, "force": always recalibrate
+LLAMA_AUTOTUNE = os.getenv("LLAMA_AUTOTUNE", "cached")
+AUTOTUNE_CACHE = Path(os.getenv("LLAMA_AUTOTUNE_CACHE", str(Path.home() / ".cache" / "ai-assistant" / "llama_autotune.json")))
+
+CALIBRATION_CTX = 1024
+PREFILL_TOKENS = 256
+DECODE_TOKENS = 32
+BATCH_SIZES = (128, 256, 512)
+CALIBRATION_TEXT = (
+    "The assistant checks the weather, reads the latest headlines, keeps track of tasks "
+    "and answers questions about almost anything the user asks during the day. "
+)
+
+
+def available_cpus() -> int:
+    """Logical CPUs this process may run on (respects affinity/cpusets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 4
+
+
+def physical_core_count() -> int:
+    """Physical cores this process may run on, counting SMT siblings once.
+
+    Falls back to the logical count when /proc/cpuinfo has no topology.
+    """
+    try:
+        allowed = os.sched_getaffinity(0)
+    except AttributeError:
+        allowed = None
+    try:
+        with open("/proc/cpuinfo") as f:
+            blocks = f.read().split("\n\n") # One block per logical CPU
+    except OSError:
+        blocks = []
+
+    cores = set()
+    for block in blocks:
+        fields = {}
+        for line in block.splitlines():
+            key, _, value = line.partition(":")
+            fields[key.strip()] = value.strip()
+        processor = fields.get("processor", "")
+        if not processor.isdigit() or "core id" not in fields:
+            continue
+        if allowed is not None and int(processor) not in allowed:
+            continue
+        cores.add((fields.get("physical id", "0"), fields["core id"]))
+
+    count = len(cores)
+    if not count:
+        try:
+            import psutil
+            count = psutil.cpu_count(logical=False) or 0
+        except ImportError:
+            count = 0
+    return max(1, min(count or available_cpus(), available_cpus()))
+
+
+def default_config() -> Dict[str, int]:
+    """Untuned settings: decode on physical cores, prefill on every available CPU."""
+    return {"n_threads": physical_core_count(), "n_threads_batch": available_cpus(), "n_batch": 512}
+
+
+def cache_key(model_path: str) -> str:
+    stat = os.stat(model_path)
+    return "|".join([
+        socket.gethostname(),
+        os.path.abspath(model_path),
+        str(stat.st_size),
+        str(int(stat.st_mtime)),
+        llama_cpp.__version__,
+    ])
+
+
+def load_cached(model_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        cache = json.loads(AUTOTUNE_CACHE.read_text())
+        return cache.get(cache_key(model_path))
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached(model_path: str, result: Dict[str, Any]):
+    try:
+        cache = json.loads(AUTOTUNE_CACHE.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    cache[cache_key(model_path)] = result
+    AUTOTUNE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = AUTOTUNE_CACHE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(cache, indent=2))
+    tmp.replace(AUTOTUNE_CACHE) # Atomic, so concurrent workers never read a partial file
+
+
+def _candidates(values) -> List[int]:
+    return sorted({v for v in values if v >= 1})
+
+
+def _measure_prefill(llm: Llama, tokens: List[int], repeats: int = 2) -> float:
+    best = 0.0
+    for _ in range(repeats): # First pass also warms caches/page-ins
+        llm.reset()
+        started = time.perf_counter()
+        llm.eval(tokens)
+        best = max(best, len(tokens) / (time.perf_counter() - started))
+    return best
+
+
+def _measure_decode(llm: Llama, tokens: List[int]) -> float:
+    llm.reset()
+    llm.eval(tokens[:16])
+    started = time.perf_counter()
+    for token in tokens[16:16 + DECODE_TOKENS]:
+        llm.eval([token]) # One token per step, like generation
+    return DECODE_TOKENS / (time.perf_counter() - started)
+
+
+def calibrate(model_path: str, n_gpu_layers: int = -1, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """Run the sweep and return the best configuration with every measurement."""
+    physical, logical = physical_core_count(), available_cpus()
+    batch_threads = _candidates([physical, logical])
+    decode_threads = _candidates([max(1, physical // 2), physical - 1, physical, logical])
+    log(f"Autotune: {physical} physical cores, {logical} logical CPUs; "
+        f"decode threads {decode_threads}, batch threads {batch_threads}, n_batch {list(BATCH_SIZES)}")
+
+    prefill, decode = [], []
+    for n_batch in BATCH_SIZES:
+        # n_batch is fixed at context creation; thread counts can change on a live context
+        llm = Llama(
+            model_path=model_path,
+            n_ctx=CALIBRATION_CTX,
+            n_batch=n_batch,
+            n_threads=physical,
+            n_threads_batch=logical,
+            n_gpu_layers=n_gpu_layers,
+            verbose=False,
+        )
+        try:
+            tokens = llm.tokenize((CALIBRATION_TEXT * 20).encode("utf-8"))[:PREFILL_TOKENS + DECODE_TOKENS]
+            for n_threads_batch in batch_threads:
+                llama_cpp.llama_set_n_threads(llm.ctx, physical, n_threads_batch)
+                tps = _measure_prefill(llm, tokens[:PREFILL_TOKENS])
+                prefill.append({"n_batch": n_batch, "n_threads_batch": n_threads_batch, "prefill_tokens_per_sec": round(tps, 2)})
+                log(f"  prefill n_batch={n_batch} n_threads_batch={n_threads_batch}: {tps:.1f} tok/s")
+
+            if n_batch == BATCH_SIZES[-1]: # Decode does not depend on n_batch; measure once
+                for n_threads in decode_threads:
+                    llama_cpp.llama_set_n_threads(llm.ctx, n_threads, logical)
+                    tps = _measure_decode(llm, tokens)
+                    decode.append({"n_threads": n_threads, "decode_tokens_per_sec": round(tps, 2)})
+                    log(f"  decode n_threads={n_threads}: {tps:.1f} tok/s")
+        finally:
+            llm.close()
+
+    best_prefill = max(prefill, key=lambda r: r["prefill_tokens_per_sec"])
+    best_decode = max(decode, key=lambda r: r["decode_tokens_per_sec"])
+    return {
+        "config": {
+            "n_threads": best_decode["n_threads"],
+            "n_threads_batch": best_prefill["n_threads_batch"],
+            "n_batch": best_prefill["n_batch"],
+        },
+        "prefill_tokens_per_sec": best_prefill["prefill_tokens_per_sec"],
+        "decode_tokens_per_sec": best_decode["decode_tokens_per_sec"],
+        "measurements": {"prefill": prefill, "decode": decode},
+        "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def resolve_config(model_path: str, mode: str = LLAMA_AUTOTUNE, n_gpu_layers: int = -1) -> Dict[str, int]:
+    """Runtime settings for `model_path` according to the autotune mode."""
+    if mode == "off":
+        return default_config()
+    if mode != "force":
+        cached = load_cached(model_path)
+        if cached:
+            print(f"Autotune: using cached config {cached['config']} for {model_path}")
+            return cached["config"]
+        if mode == "cached":
+            return default_config()
+
+    print(f"Autotune: calibrating {model_path} (LLAMA_AUTOTUNE={mode})")
+    try:
+        result = calibrate(model_path, n_gpu_layers)
+    except Exception as e:
+        print(f"Autotune: calibration failed, using defaults: {e}")
+        return default_config()
+    save_cached(model_path, result)
+    print(f"Autotune: selected {result['config']} "
+          f"(prefill {result['prefill_tokens_per_sec']} tok/s, decode {result['decode_tokens_per_sec']} tok/s)")
+    return result["config"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate llama.cpp thread and batch settings for this host")
+    parser.add_argument("--model", required=True, help="GGUF model path")
+    parser.add_argument("--n-gpu-layers", type=int, default=-1)
+    parser.add_argument("--no-save", action="store_true", help="report only; do not update the cache file")
+    args = parser.parse_args()
+
+    result = calibrate(args.model, args.n_gpu_layers)
+    if not args.no_save:
+        save_cached(args.model, result)
+        print(f"Saved to {AUTOTUNE_CACHE}")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# app/chat_ws.py
+"""WebSocket chat sessions.
+
+The client authenticates once per connection, with ``?token=<jwt>`` or a first
+``{"type": "auth", "token": ...}`` frame. The server keeps the recent turns as
+model context, streams the answer as it is generated and saves each finished
+turn to the conversation history.
+
+Client frames:
+    {"type": "chat", "id": "1", "prompt": "...", "speculative": true, "tool_mode": "grammar"}
+    {"type": "cancel", "id": "1"}
+    {"type": "ping"}
+Server frames:
+    {"type": "ready", "user": "alice"}
+    {"type": "token", "id": "1", "text": "..."}
+    {"type": "tool", "id": "1", "name": "weather", "arguments": {...}, "result": "..."}
+    {"type": "done", "id": "1", "response": "...", "usage": {...}}
+    {"type": "cancelled", "id": "1"}
+    {"type": "error", "id": "1", "status": 429, "detail": "...", "retry_after": 3}
+    {"type": "pong"}
+
+An idle connection is one suspended receive() plus its history; tasks exist
+only while a turn is generating.
+"""
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, database, llama_engine, models, security
+from .config import settings
+from .quotas import quota_manager, record_llm_usage
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+AUTH_TIMEOUT = 10 # Seconds to send the auth frame when no ?token= was given
+TOOL_MODES = ("keywords", "grammar")
+
+
+def _authenticate(token: str) -> Tuple[int, str]:
+    db = database.SessionLocal()
+    try:
+        user = security.user_from_token(token, db)
+        return user.id, user.username
+    finally:
+        db.close()
+
+
+def _fit(text: str, column) -> str:
+    """Truncate to the column's declared length."""
+    length = column.type.length
+    return text[:length] if length else text
+
+
+def _save_turn(user_id: int, message: str, response: str):
+    db = database.SessionLocal()
+    try:
+        db.add(models.ConversationHistory(
+            user_id=user_id,
+            message=_fit(message, models.ConversationHistory.message),
+            response=_fit(response, models.ConversationHistory.response),
+        ))
+        crud.bump_version(db, user_id, "conversations")
+        db.commit()
+    finally:
+        db.close()
+
+
+def _merge_tokens(frames: List[Optional[Dict[str, Any]]]) -> List[Optional[Dict[str, Any]]]:
+    """Join consecutive token frames, so a slow client gets fewer, larger frames."""
+    merged = []
+    for frame in frames:
+        if frame is not None and frame["type"] == "token" and merged and merged[-1] is not None and merged[-1]["type"] == "token":
+            merged[-1] = {**merged[-1], "text": merged[-1]["text"] + frame["text"]}
+        else:
+            merged.append(frame)
+    return merged
+
+
+class ChatSession:
+    def __init__(self, websocket: WebSocket, user_id: int, username: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.username = username
+        self.history: Deque[Dict[str, str]] = deque(maxlen=2 * settings.WS_HISTORY_TURNS)
+        self.turn: Optional[asyncio.Task] = None
+        self.turn_id: Optional[str] = None # Set while a turn is generating
+        self.cancelled = False
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: Dict[str, Any]):
+        if self.closed:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(json.dumps(frame))
+            except (WebSocketDisconnect, RuntimeError):
+                self.closed = True
+
+    async def _stopped(self) -> bool:
+        return self.closed or self.cancelled
+
+    async def start_turn(self, frame: Dict[str, Any]):
+        """Start generating in the background; the receive loop keeps reading frames meanwhile."""
+        turn_id = str(frame.get("id", ""))
+        prompt = frame.get("prompt")
+        tool_mode = frame.get("tool_mode")
+        if self.turn_id is not None:
+            await self.send({"type": "error", "id": turn_id, "status": status.HTTP_409_CONFLICT,
+                             "detail": f"Turn {self.turn_id!r} is still generating"})
+            return
+        if not isinstance(prompt, str) or not prompt.strip() or tool_mode not in (None, *TOOL_MODES):
+            await self.send({"type": "error", "id": turn_id, "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                             "detail": "Expected a non-empty prompt and tool_mode of " + ", ".join(TOOL_MODES)})
+            return
+        try:
+            engine = llama_engine.llm_engine
+            # Oldest turns are dropped once the history would overflow the context window
+            context = {"history": engine.fit_history(list(self.history), prompt, tool_mode) if engine else list(self.history)}
+            reserved = quota_manager.reserve(self.user_id, engine.reservation(prompt, context, tool_mode) if engine else 0)
+        except HTTPException as e:
+            await self.send({"type": "error", "id": turn_id, "status": e.status_code, "detail": e.detail,
+                             "retry_after": int(e.headers["Retry-After"])})
+            return
+
+        self.turn_id = turn_id
+        self.cancelled = False
+        self.turn = asyncio.create_task(self._run_turn(turn_id, prompt, context, frame.get("speculative"), tool_mode, reserved))
+
+    def cancel_turn(self, frame: Dict[str, Any]):
+        if self.turn_id is not None and str(frame.get("id", self.turn_id)) == self.turn_id:
+            self.cancelled = True # Decoding stops at the next token
+
+    async def _run_turn(self, turn_id: str, prompt: str, context: Dict[str, Any], speculative: Optional[bool],
+                        tool_mode: Optional[str], reserved: int):
+        # Tokens and tool results go through one queue, so frames keep their order
+        frames: asyncio.Queue = asyncio.Queue()
+        sender = asyncio.create_task(self._forward(frames))
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        reply = None
+        try:
+            reply = await llama_engine.llm_engine.generate_response(
+                prompt,
+                context=context,
+                speculative=speculative,
+                is_disconnected=self._stopped,
+                user_key=self.user_id,
+                usage=usage,
+                tool_mode=tool_mode,
+                on_token=lambda text: frames.put_nowait({"type": "token", "id": turn_id, "text": text}),
+                on_tool=lambda name, arguments, result: frames.put_nowait(
+                    {"type": "tool", "id": turn_id, "name": name, "arguments": arguments, "result": result}),
+            )
+            self.history.extend([{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}])
+            final = {"type": "done", "id": turn_id, "response": reply, "usage": usage}
+        except HTTPException as e:
+            if self.cancelled:
+                final = {"type": "cancelled", "id": turn_id, "usage": usage}
+            else:
+                final = {"type": "error", "id": turn_id, "status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"Chat socket turn failed: {e}")
+            final = {"type": "error", "id": turn_id, "status": 500, "detail": str(e)}
+        finally:
+            record_llm_usage(self.user_id, self.user_id, usage, reserved)
+            frames.put_nowait(None)
+            await sender
+
+        # Free the session before the final frame, so the client's next chat is accepted
+        self.turn_id = None
+        await self.send(final)
+        if reply is not None:
+            try:
+                await run_in_threadpool(_save_turn, self.user_id, prompt, reply)
+            except Exception as e:
+                logger.error(f"Saving chat turn failed: {e}")
+
+    async def _forward(self, frames: asyncio.Queue):
+        while True:
+            batch = [await frames.get()]
+            while not frames.empty():
+                batch.append(frames.get_nowait())
+            for frame in _merge_tokens(batch):
+                if frame is None:
+                    return
+                await self.send(frame)
+
+
+async def _receive_frame(websocket: WebSocket, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+    """Next JSON object from the client; None for anything else, binary frames included."""
+    message = await asyncio.wait_for(websocket.receive(), timeout)
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("text") is None:
+        return None
+    try:
+        frame = json.loads(message["text"])
+    except json.JSONDecodeError:
+        return None
+    return frame if isinstance(frame, dict) else None
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    await websocket.accept()
+    token = websocket.query_params.get("token")
+    try:
+        if token is None:
+            frame = await _receive_frame(websocket, AUTH_TIMEOUT)
+            token = frame.get("token") if frame and frame.get("type") == "auth" else None
+        user_id, username = await run_in_threadpool(_authenticate, token or "")
+    except (HTTPException, asyncio.TimeoutError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
+        return
+    except WebSocketDisconnect:
+        return
+
+    session = ChatSession(websocket, user_id, username)
+    await session.send({"type": "ready", "user": username})
+    idle_timeout = settings.WS_IDLE_TIMEOUT or None
+    try:
+        while True:
+            try:
+                frame = await _receive_frame(websocket, idle_timeout)
+            except asyncio.TimeoutError:
+                if session.turn_id is not None:
+                    continue
+                await websocket.close(code=status.WS_1000_NORMAL_CLOSURE, reason="Idle timeout")
+                break
+
+            kind = frame.get("type") if frame else None
+            if kind == "chat":
+                await session.start_turn(frame)
+            elif kind == "cancel":
+                session.cancel_turn(frame)
+            elif kind == "ping":
+                await session.send({"type": "pong"})
+            else:
+                await session.send({"type": "error", "status": status.HTTP_400_BAD_REQUEST, "detail": "Unknown frame"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.closed = True
+        if session.turn is not None:
+            # Let an in-flight turn stop, record its usage and save
+            await asyncio.wait([session.turn])
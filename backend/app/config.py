@@ -9,6 +9,12 @@ class Settings(BaseSettings):
     ELEVEN_API_KEY: str
     OPENWEATHER_API_KEY: str
     NEWS_API_KEY: str
+    USER_TOKENS_PER_MINUTE: int = 20000  # Per-user LLM token budget; 0 disables rate limiting
+    USER_TOKEN_BURST: int = 0  # Bucket size; 0 -> one minute of budget
+    USAGE_FLUSH_SECONDS: float = 5.0  # How often aggregated token usage is written to the DB
+    WS_IDLE_TIMEOUT: float = 900  # Close chat sockets with no client frames for this long; 0 disables
+    WS_HISTORY_TURNS: int = 6  # Earlier turns kept as model context per chat socket
+    CACHE_WARM_INTERVAL: float = 15.0  # Seconds between weather/news cache warming passes; 0 disables
 
     class Config:
         env_file = ".env"
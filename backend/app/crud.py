@@ -1,10 +1,13 @@
 # crud.py
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from . import models, schemas
 
 # Create a new task
 def create_task(db: Session, task: schemas.TaskCreate, user_id: int):
-    db_task = models.Task(task_name=task.task_name, owner_id=user_id)
+    db_task = models.Task(task_name=task.task_name, user_id=user_id)
     db.add(db_task)
     db.commit()
     db.refresh(db_task)
@@ -12,7 +15,7 @@ def create_task(db: Session, task: schemas.TaskCreate, user_id: int):
 
 # Get all tasks for a user
 def get_tasks(db: Session, user_id: int):
-    return db.query(models.Task).filter(models.Task.owner_id == user_id).all()
+    return db.query(models.Task).filter(models.Task.user_id == user_id).all()
 
 # Get a single task by ID
 def get_task(db: Session, task_id: int):
@@ -41,3 +44,28 @@ def delete_task(db: Session, task_id: int):
         db.commit()
         return True
     return False
+
+# Record a change to one of a user's collections; call it in the same transaction as the change
+def bump_version(db: Session, user_id: int, resource: str):
+    now = datetime.utcnow()
+    increment = (
+        update(models.ResourceVersion)
+        .where(models.ResourceVersion.user_id == user_id, models.ResourceVersion.resource == resource)
+        .values(version=models.ResourceVersion.version + 1, updated_at=now)
+    )
+    if db.execute(increment).rowcount:
+        return
+    try:
+        # Savepoint: if a concurrent request inserted the row first, only this insert is undone
+        with db.begin_nested():
+            db.add(models.ResourceVersion(user_id=user_id, resource=resource, version=1, updated_at=now))
+    except IntegrityError:
+        db.execute(increment)
+
+# Weak ETag for a user's collection; changes whenever bump_version is called
+def resource_etag(db: Session, user_id: int, resource: str) -> str:
+    row = db.query(models.ResourceVersion.version, models.ResourceVersion.updated_at).filter(
+        models.ResourceVersion.user_id == user_id, models.ResourceVersion.resource == resource
+    ).first()
+    version, stamp = (row.version, int(row.updated_at.timestamp() * 1000)) if row else (0, 0)
+    return f'W/"{resource}-{user_id}-{version}-{stamp}"'
@@ -2,7 +2,6 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
-from contextlib import asynccontextmanager
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
@@ -17,9 +16,8 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-@asynccontextmanager
-async def get_db():
-    """Async generator for database sessions."""
+def get_db():
+    """Yield a database session; used as a FastAPI dependency."""
     db = SessionLocal()
     try:
         yield db
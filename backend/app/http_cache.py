@@ -0,0 +1,103 @@
+# app/http_cache.py
+"""Conditional JSON responses: ETags, If-None-Match -> 304, Cache-Control and compression.
+
+ETags are weak (W/"..."), so one validator covers the identity, gzip and
+brotli encodings of the same body.
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024 # Smaller bodies are not worth the CPU or the extra header
+PRIVATE_REVALIDATE = "private, no-cache" # Per-user data: browsers may store it but must revalidate
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def content_etag(body: bytes) -> str:
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison against If-None-Match (a list or "*")."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def _accepted_encodings(request: Request) -> Dict[str, float]:
+    encodings = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                pass
+        if name:
+            encodings[name.lower()] = q
+    return encodings
+
+
+def compress(request: Request, body: bytes):
+    """Body and Content-Encoding (None if sent uncompressed) for this client."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = _accepted_encodings(request)
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return brotli.compress(body, quality=5), "br" # Mid quality: most of the gain, a fraction of the CPU
+    if accepted.get("gzip", 0) > 0:
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"})
+
+
+def json_response(request: Request, content: Any, cache_control: str, etag: Optional[str] = None) -> Response:
+    """Serialize `content` and answer 304 if the client already has it.
+
+    Without `etag` the ETag is a hash of the serialized body, which saves
+    bandwidth; callers that can tell cheaply whether data changed should use
+    conditional_json() instead, which also skips loading and serializing.
+    """
+    body = dumps(content)
+    etag = etag or content_etag(body)
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+
+    body, encoding = compress(request, body)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def conditional_json(request: Request, etag: str, load: Callable[[], Any], cache_control: str = PRIVATE_REVALIDATE) -> Response:
+    """304 if `etag` matches; otherwise call `load` and send its result."""
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+    return json_response(request, load(), cache_control, etag)
@@ -4,24 +4,160 @@ import os
 import httpx # Use asynchronous HTTP client
 import json
 import asyncio # Needed for run_in_executor
-from typing import Optional, Dict, Any
-from llama_cpp import Llama
+import threading
+import time
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from llama_cpp import Llama, LlamaGrammar
 from fastapi import HTTPException
+from .speculative import build_draft_model
+from .scheduler import FairScheduler
+from .autotune import resolve_config
+
+LLAMA_N_CTX = int(os.getenv("LLAMA_N_CTX", "2048"))
+
+# Base URL of this API, used by the tool handlers (overridable for benchmarks/deployments)
+API_BASE_URL = os.getenv("ASSISTANT_API_URL", "http://localhost:8000")
+
+# Speculative decoding: "off", "prompt_lookup" or "draft_model" (needs LLAMA_DRAFT_MODEL_PATH)
+LLAMA_DRAFT_MODE = os.getenv("LLAMA_DRAFT_MODE", "off")
+LLAMA_DRAFT_MODEL_PATH = os.getenv("LLAMA_DRAFT_MODEL_PATH")
+LLAMA_DRAFT_TOKENS = int(os.getenv("LLAMA_DRAFT_TOKENS", "0")) or None # 0 -> per-mode default
+# Whether requests use the draft unless they opt out with speculative=false
+LLAMA_SPECULATIVE_DEFAULT = os.getenv("LLAMA_SPECULATIVE_DEFAULT", "1") == "1"
+
+# Generations still running this many seconds after they were queued are stopped (0 disables)
+LLAMA_REQUEST_TIMEOUT = float(os.getenv("LLAMA_REQUEST_TIMEOUT", "120"))
+DISCONNECT_POLL_INTERVAL = 0.25 # Seconds between client-disconnect checks while decoding
+
+# Tool selection: "keywords" (heuristics, one tool) or "grammar" (model emits JSON tool calls)
+LLAMA_TOOL_MODE = os.getenv("LLAMA_TOOL_MODE", "keywords")
+CHAT_MAX_TOKENS = 200 # Cap for a plain answer
+TOOL_CALL_MAX_TOKENS = 96 # Cap for the tool-call step; a few short JSON calls fit easily
+TOOL_ANSWER_MAX_TOKENS = 150 # Cap for the answer written from tool results
+MAX_TOOL_CALLS = 3
+TOOL_RESULTS_TOKENS = 512 # Room kept for tool results in the answer pass when fitting history
+TEMPLATE_TOKENS_PER_MESSAGE = 8 # Chat-template overhead allowed per message when fitting history
+
+# Arguments per tool, as JSON-schema properties (all required)
+TOOL_ARGUMENTS = {
+    "weather": {"location": {"type": "string"}},
+    "news": {"topic": {"type": "string"}},
+    "calculator": {"expression": {"type": "string"}},
+}
+
+TOOL_SYSTEM_PROMPT = (
+    "You decide which tools are needed to answer the user. Reply only with JSON of the form "
+    '{"calls": [{"tool": ..., "arguments": {...}}]}; use an empty list if no tool is needed. '
+    "Tools: weather(location) - current weather for a city; news(topic) - latest headlines on a topic; "
+    "calculator(expression) - evaluate an arithmetic expression. "
+    "Call a tool once per distinct location or topic."
+)
+
+def tool_call_schema() -> Dict[str, Any]:
+    """JSON schema for the tool-call step, used to build its grammar."""
+    return {
+        "type": "object",
+        "properties": {
+            "calls": {
+                "type": "array",
+                "maxItems": MAX_TOOL_CALLS,
+                "items": {
+                    "anyOf": [
+                        {
+                            "type": "object",
+                            "properties": {
+                                "tool": {"const": name},
+                                "arguments": {"type": "object", "properties": args, "required": list(args)},
+                            },
+                            "required": ["tool", "arguments"],
+                        }
+                        for name, args in TOOL_ARGUMENTS.items()
+                    ]
+                },
+            }
+        },
+        "required": ["calls"],
+    }
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is abandoned because the client left or the deadline passed."""
+    def __init__(self, reason: str, started: bool):
+        super().__init__(f"Generation cancelled ({reason}, {'during decode' if started else 'before start'})")
+        self.reason = reason
+        self.started = started
+
+class CancelToken:
+    """Cancellation state for one generation, checked after every streamed token."""
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline # time.monotonic() value
+        self.reason: Optional[str] = None
+        self.stopped = False # True once decoding was actually cut short
+
+    def cancel(self, reason: str = "disconnected"):
+        if self.reason is None:
+            self.reason = reason
+
+    def check(self) -> Optional[str]:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "deadline"
+        return self.reason
+
+    def should_stop(self) -> bool:
+        if self.check() is not None:
+            self.stopped = True
+        return self.stopped
 
 class EnhancedLlama:
-    def __init__(self, model_path: str):
-        # Determine number of threads based on CPU cores
-        cpu_threads = os.cpu_count() or 4 # Use detected cores, default to 4 if detection fails
+    def __init__(
+        self,
+        model_path: str,
+        llm: Optional[Llama] = None,
+        draft_mode: Optional[str] = None,
+        draft_model_path: Optional[str] = None,
+        draft_tokens: Optional[int] = None,
+    ):
+        self._init_api_handlers()
+        self._llm_lock = threading.Lock() # A llama.cpp context must not be used from two threads at once
+        # Requests queue here (not in executor threads) so they can be dropped, and are
+        # dispatched fair-share across users rather than first-come first-served
+        self.scheduler = FairScheduler(slots=1)
+        self.inference_stats = {"completed": 0, "cancelled": 0, "dropped": 0, "completion_tokens": 0, "wasted_tokens": 0}
+        self.draft_mode = draft_mode or LLAMA_DRAFT_MODE
+        self.speculative_default = LLAMA_SPECULATIVE_DEFAULT
+        self.draft_model = None
+        self.tool_mode = LLAMA_TOOL_MODE
+        self._tool_grammar = None # Compiled on first use
+        if llm is not None:
+            # Pre-built model (e.g. the benchmark's fake Llama); skip loading from disk
+            self.llm = llm
+            return
+
         requested_gpu_layers = -1 # Store the value you requested
 
         try:
             print(f"Attempting to load Llama model from: {model_path}")
-            print(f"Using config: n_threads={cpu_threads}, n_gpu_layers={requested_gpu_layers}, n_ctx=2048")
+            # Thread and batch settings: physical cores by default, or the autotuned
+            # result for this host and model file (LLAMA_AUTOTUNE, see app/autotune.py)
+            self.runtime_config = resolve_config(model_path, n_gpu_layers=requested_gpu_layers)
+            cpu_threads = self.runtime_config["n_threads"]
+            print(f"Using config: {self.runtime_config}, n_gpu_layers={requested_gpu_layers}, n_ctx={LLAMA_N_CTX}, draft_mode={self.draft_mode}")
+            # A draft model must be passed at construction: it makes llama.cpp keep logits for every
+            # position, which verification needs. Requests can still opt out per call.
+            self.draft_model = build_draft_model(
+                self.draft_mode,
+                draft_model_path=draft_model_path or LLAMA_DRAFT_MODEL_PATH,
+                num_pred_tokens=draft_tokens or LLAMA_DRAFT_TOKENS,
+                n_ctx=LLAMA_N_CTX,
+                n_threads=cpu_threads,
+            )
             self.llm = Llama(
                 model_path=model_path,
-                n_ctx=2048,
+                n_ctx=LLAMA_N_CTX,
                 n_threads=cpu_threads,
+                n_threads_batch=self.runtime_config["n_threads_batch"],
+                n_batch=self.runtime_config["n_batch"],
                 n_gpu_layers=requested_gpu_layers, # Pass the requested value
+                draft_model=self.draft_model,
                 verbose=True # Set to True for detailed llama.cpp output
             )
             # Modified print statement: Confirms loading without accessing the non-existent attribute
@@ -36,45 +172,355 @@ class EnhancedLlama:
             traceback.print_exc()
             raise RuntimeError(f"Could not initialize Llama model: {e}") from e
 
+    def _init_api_handlers(self):
         self.api_handlers = {
             'weather': self._handle_weather_query,
             'news': self._handle_news_query,
             'calculator': self._handle_calculation
         }
-    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+
+    def create_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 200,
+        temperature: float = 0.7,
+        speculative: Optional[bool] = None,
+        cancel: Optional[CancelToken] = None,
+        grammar: Optional[LlamaGrammar] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        """Blocking chat completion; run it in an executor from async code.
+
+        speculative=None uses the deployment default. It has no effect when no draft
+        model was configured at startup. `grammar` constrains the output. `on_token`
+        is called from the decoding thread with each piece of streamed text.
+
+        The completion is always streamed internally (create_chat_completion takes no
+        stopping_criteria), so decoding stops at the next token once `cancel` is
+        cancelled or its deadline passes. The result has the non-streaming response
+        shape. Streaming reports no usage, so prompt_tokens is llama.cpp's count of
+        evaluated prompt tokens (chat template included) and completion_tokens is the
+        output text re-tokenized.
+        """
+        use_draft = self.speculative_default if speculative is None else speculative
+        with self._llm_lock:
+            self.llm.draft_model = self.draft_model if use_draft else None
+            chunks = self.llm.create_chat_completion(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                grammar=grammar
+            )
+            text = []
+            finish_reason = None
+            evaluated = None
+            try:
+                for chunk in chunks:
+                    if evaluated is None:
+                        # The first chunk comes once the templated prompt and the tokens behind
+                        # the first piece of text, all but the last, have been evaluated
+                        evaluated = self.llm.n_tokens
+                    choice = chunk["choices"][0]
+                    content = choice["delta"].get("content")
+                    if content:
+                        if not text:
+                            evaluated -= max(0, self._count_tokens(content) - 1)
+                        text.append(content)
+                        if on_token is not None:
+                            on_token(content)
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    if cancel is not None and cancel.should_stop():
+                        finish_reason = "cancelled"
+                        break
+            finally:
+                chunks.close() # Ends llama.cpp generation if we stopped early
+            prompt_tokens = evaluated or 0
+            # Re-tokenizing can split odd text into more tokens than were generated; never more than max_tokens
+            completion_tokens = min(self._count_tokens("".join(text)), max_tokens)
+
+        return {
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(text)},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False)) if text else 0
+
+    def reservation(self, prompt: str, context: Optional[Dict[str, Any]] = None, tool_mode: Optional[str] = None) -> int:
+        """Upper estimate of the tokens generate_response will use, held against the quota on admission."""
+        history = (context or {}).get("history", [])
+        prompt_tokens = self._count_tokens("\n".join([*(m["content"] for m in history), prompt]))
+        if (tool_mode or self.tool_mode) == "grammar":
+            # Tool-call pass plus answer pass; the answer's tool results are not known yet
+            return 2 * prompt_tokens + TOOL_CALL_MAX_TOKENS + TOOL_ANSWER_MAX_TOKENS
+        return prompt_tokens + CHAT_MAX_TOKENS
+
+    def fit_history(self, history: List[Dict[str, str]], prompt: str, tool_mode: Optional[str] = None) -> List[Dict[str, str]]:
+        """The most recent whole turns of `history` that fit the context window.
+
+        Room is kept for `prompt`, the largest completion and, in grammar mode, the
+        tool-call system prompt or the tool results, whichever pass is larger.
+        """
+        if (tool_mode or self.tool_mode) == "grammar":
+            overhead = max(self._count_tokens(TOOL_SYSTEM_PROMPT) + TOOL_CALL_MAX_TOKENS, TOOL_RESULTS_TOKENS + TOOL_ANSWER_MAX_TOKENS)
+        else:
+            overhead = CHAT_MAX_TOKENS
+        budget = self.llm.n_ctx() - overhead - self._count_tokens(prompt) - 2 * TEMPLATE_TOKENS_PER_MESSAGE
+        sizes = [self._count_tokens(m["content"]) + TEMPLATE_TOKENS_PER_MESSAGE for m in history]
+        start = len(history) % 2 # History is user/assistant pairs; drop whole turns
+        total = sum(sizes[start:])
+        while start < len(history) and total > budget:
+            total -= sum(sizes[start:start + 2])
+            start += 2
+        return history[start:]
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 200,
+        temperature: float = 0.7,
+        speculative: Optional[bool] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        timeout: float = LLAMA_REQUEST_TIMEOUT,
+        user_key: Any = None,
+        usage: Optional[Dict[str, int]] = None,
+        grammar: Optional[LlamaGrammar] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        """Wait for the model slot and run one completion in the executor.
+
+        Raises GenerationCancelled if the client disconnects or the timeout expires,
+        either while queued (the request is dropped unstarted) or while decoding.
+        `user_key` identifies the requester for fair-share dispatch; `usage`, if given,
+        accumulates the prompt/completion token counts, including for cancelled runs.
+        `on_token`, if given, is called on the event loop with each piece of streamed text.
+        """
+        cancel = CancelToken(time.monotonic() + timeout if timeout else None)
+        async with self.scheduler.slot(user_key) as ticket:
+            if is_disconnected is not None and await is_disconnected():
+                cancel.cancel("disconnected")
+            if cancel.check():
+                self.inference_stats["dropped"] += 1
+                raise GenerationCancelled(cancel.reason, started=False)
+
+            loop = asyncio.get_running_loop()
+            emit = (lambda text: loop.call_soon_threadsafe(on_token, text)) if on_token else None
+            future = loop.run_in_executor(
+                None,
+                lambda: self.create_completion(messages, max_tokens, temperature, speculative, cancel, grammar, emit)
+            )
+            watcher = asyncio.create_task(self._watch_disconnect(is_disconnected, cancel)) if is_disconnected else None
+            try:
+                response = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The handler itself was cancelled: stop decoding and keep the slot until the thread is done
+                cancel.cancel("cancelled")
+                await asyncio.wait([future])
+                raise
+            finally:
+                if watcher:
+                    watcher.cancel()
+
+            response_usage = response.get("usage", {})
+            tokens = response_usage.get("completion_tokens", 0)
+            ticket.charge(response_usage.get("prompt_tokens", 0) + tokens)
+            if usage is not None:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + response_usage.get("prompt_tokens", 0)
+                usage["completion_tokens"] = usage.get("completion_tokens", 0) + tokens
+
+        self.inference_stats["completion_tokens"] += tokens
+        if cancel.stopped:
+            self.inference_stats["cancelled"] += 1
+            self.inference_stats["wasted_tokens"] += tokens
+            raise GenerationCancelled(cancel.reason, started=True)
+        self.inference_stats["completed"] += 1
+        return response
+
+    @staticmethod
+    async def _watch_disconnect(is_disconnected: Callable[[], Awaitable[bool]], cancel: CancelToken):
+        while cancel.check() is None:
+            if await is_disconnected():
+                cancel.cancel("disconnected")
+                return
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    def decoding_stats(self) -> Dict[str, Any]:
+        """Current decoding configuration and cumulative draft counters."""
+        stats = {"draft_mode": self.draft_mode if self.draft_model else "off", "speculative_default": self.speculative_default}
+        if self.draft_model is not None:
+            stats.update(self.draft_model.snapshot())
+        return stats
+
+    async def generate_response(
+        self,
+        prompt: str,
+        context: Optional[Dict[str, Any]] = None,
+        speculative: Optional[bool] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        user_key: Any = None,
+        usage: Optional[Dict[str, int]] = None,
+        tool_mode: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+        on_tool: Optional[Callable[[str, Dict[str, Any], str], None]] = None,
+    ) -> str:
+        """Answer `prompt`, using tools where needed.
+
+        context["history"] may hold earlier turns as chat messages. `on_token` and
+        `on_tool` (name, arguments, result) are called on the event loop as answer
+        text is generated and tool results arrive.
+        """
+        context = context or {}
+        llm_options = dict(speculative=speculative, is_disconnected=is_disconnected, user_key=user_key, usage=usage, on_token=on_token)
+        use_grammar_tools = (tool_mode or self.tool_mode) == "grammar"
+
         # Check for API triggers first
-        for api_type, handler in self.api_handlers.items():
-            if self._should_use_api(prompt, api_type):
-                try:
-                    # API handlers are now async thanks to httpx
-                    return await handler(prompt, context or {})
-                except Exception as e:
-                    # Log the specific API failure
-                    print(f"API handler '{api_type}' failed: {str(e)}")
-                    # Provide a user-friendly error message
-                    return f"I encountered an issue trying to fetch {api_type} data. Please try again later."
+        if not use_grammar_tools:
+            tool_response = await self._keyword_tool_response(prompt, context, on_tool)
+            if tool_response is not None:
+                return tool_response
 
         # Default LLM response - Run blocking inference in executor
         try:
-            loop = asyncio.get_running_loop()
-
-            response = await loop.run_in_executor(
-                None, 
-                lambda:self.llm.create_chat_completion(
-                    messages=[{"role":"user","content":prompt}],
-                    max_tokens=200,
-                    temperature=0.7
-                )
+            if use_grammar_tools:
+                return await self._respond_with_tools(prompt, context, on_tool, **llm_options)
+
+            response = await self.complete(
+                messages=[*context.get("history", []), {"role":"user","content":prompt}],
+                max_tokens=CHAT_MAX_TOKENS,
+                temperature=0.7,
+                **llm_options
             )
             
             return response['choices'][0]['message']['content'].strip()
 
+        except GenerationCancelled as e:
+            print(f"LLM generation stopped: {e}")
+            # 499 = client closed request (nginx convention); nobody is waiting for the body anyway
+            raise HTTPException(status_code=504 if e.reason == "deadline" else 499, detail=str(e))
         except Exception as e:
             # Log the detailed LLM error
             print(f"LLM generation failed: {str(e)}")
             # Raise HTTPException to let FastAPI handle the server error response
             raise HTTPException(status_code=500, detail=f"LLM Error: Could not generate response.")
 
+    async def _keyword_tool_response(self, prompt: str, context: Dict[str, Any], on_tool=None) -> Optional[str]:
+        """Answer with the first tool whose keywords match the prompt, or None if none match."""
+        for api_type, handler in self.api_handlers.items():
+            if self._should_use_api(prompt, api_type):
+                try:
+                    # API handlers are now async thanks to httpx
+                    result = await handler(prompt, context)
+                except Exception as e:
+                    # Log the specific API failure
+                    print(f"API handler '{api_type}' failed: {str(e)}")
+                    # Provide a user-friendly error message
+                    result = f"I encountered an issue trying to fetch {api_type} data. Please try again later."
+                if on_tool is not None:
+                    on_tool(api_type, {}, result)
+                return result
+        return None
+
+    async def _respond_with_tools(self, prompt: str, context: Dict[str, Any], on_tool=None, **llm_options) -> str:
+        """Grammar-constrained tool calling.
+
+        A short, grammar-constrained pass emits the tool calls, the calls run
+        concurrently, and a second capped pass turns the results into the answer.
+        The model slot is released while the tools run.
+        """
+        if self._tool_grammar is None:
+            self._tool_grammar = LlamaGrammar.from_json_schema(json.dumps(tool_call_schema()), verbose=False)
+
+        history = context.get("history", [])
+        plan = await self.complete(
+            messages=[{"role": "system", "content": TOOL_SYSTEM_PROMPT}, *history, {"role": "user", "content": prompt}],
+            max_tokens=TOOL_CALL_MAX_TOKENS,
+            temperature=0.0,
+            grammar=self._tool_grammar,
+            **{**llm_options, "on_token": None} # The tool-call JSON is not part of the answer
+        )
+        calls = self._parse_tool_calls(plan['choices'][0]['message']['content'])
+        if calls is None:
+            # Truncated or malformed output; fall back to the keyword heuristics
+            tool_response = await self._keyword_tool_response(prompt, context, on_tool)
+            if tool_response is not None:
+                return tool_response
+            calls = []
+
+        if not calls:
+            response = await self.complete(
+                messages=[*history, {"role": "user", "content": prompt}],
+                max_tokens=CHAT_MAX_TOKENS,
+                temperature=0.7,
+                **llm_options
+            )
+            return response['choices'][0]['message']['content'].strip()
+
+        results = await asyncio.gather(
+            *(self._run_tool(call["tool"], call["arguments"]) for call in calls),
+            return_exceptions=True
+        )
+        if on_tool is not None:
+            for call, result in zip(calls, results):
+                on_tool(call["tool"], call["arguments"], f"Error: {result}" if isinstance(result, Exception) else result)
+        tool_report = "\n\n".join(
+            f"[{call['tool']} {json.dumps(call['arguments'])}]\n"
+            + (f"Error: {result}" if isinstance(result, Exception) else result)
+            for call, result in zip(calls, results)
+        )
+        answer = await self.complete(
+            messages=[
+                {"role": "system", "content": "Answer the user briefly using only these tool results:\n\n" + tool_report},
+                *history,
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=TOOL_ANSWER_MAX_TOKENS,
+            temperature=0.3,
+            **llm_options
+        )
+        return answer['choices'][0]['message']['content'].strip()
+
+    @staticmethod
+    def _parse_tool_calls(text: str) -> Optional[List[Dict[str, Any]]]:
+        """Validated tool calls from the tool-call step, or None if the output is unusable."""
+        try:
+            calls = json.loads(text)["calls"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            print(f"Unparseable tool-call output: {text!r}")
+            return None
+        if not isinstance(calls, list):
+            return None
+
+        valid = []
+        seen = set()
+        for call in calls[:MAX_TOOL_CALLS]:
+            name = call.get("tool") if isinstance(call, dict) else None
+            arguments = call.get("arguments") if name in TOOL_ARGUMENTS else None
+            if not isinstance(arguments, dict) or not all(isinstance(arguments.get(k), str) and arguments[k].strip() for k in TOOL_ARGUMENTS[name]):
+                continue
+            key = (name, json.dumps(arguments, sort_keys=True).lower())
+            if key not in seen: # Skip duplicate calls
+                seen.add(key)
+                valid.append({"tool": name, "arguments": arguments})
+        return valid
+
+    async def _run_tool(self, name: str, arguments: Dict[str, str]) -> str:
+        if name == "weather":
+            return await self._fetch_weather(arguments["location"].strip())
+        if name == "news":
+            return await self._fetch_news(arguments["topic"].strip() or "general")
+        if name == "calculator":
+            return self._evaluate_expression(arguments["expression"])
+        raise ValueError(f"Unknown tool '{name}'")
+
     def _should_use_api(self, prompt: str, api_type: str) -> bool:
         # This logic remains the same - it's very fast
         prompt_lower = prompt.lower()
@@ -93,8 +539,10 @@ class EnhancedLlama:
         location = self._extract_location(prompt)
         if not location:
             return "Please specify a location for the weather information (e.g., 'weather in London')."
+        return await self._fetch_weather(location)
 
-        api_url = "http://localhost:8000/weather/" # Ensure this endpoint is running
+    async def _fetch_weather(self, location: str) -> str:
+        api_url = f"{API_BASE_URL}/weather/" # Ensure this endpoint is running
         try:
             async with httpx.AsyncClient() as client:
                 print(f"Requesting weather for: {location}")
@@ -131,7 +579,10 @@ class EnhancedLlama:
 
     async def _handle_news_query(self, prompt: str, context: Dict[str, Any]) -> str:
         topic = self._extract_topic(prompt) or "general"
-        api_url = "http://localhost:8000/news/" # Ensure this endpoint is running
+        return await self._fetch_news(topic)
+
+    async def _fetch_news(self, topic: str) -> str:
+        api_url = f"{API_BASE_URL}/news/" # Ensure this endpoint is running
         try:
             async with httpx.AsyncClient() as client:
                 print(f"Requesting news for topic: {topic}")
@@ -166,21 +617,23 @@ class EnhancedLlama:
              raise
 
     async def _handle_calculation(self, prompt: str, context: Dict[str, Any]) -> str:
+        # Slightly improved extraction - find 'calculate' and take text after it
+        parts = prompt.lower().split("calculate", 1)
+        if len(parts) < 2:
+             # Try basic check if the prompt itself looks like an expression
+             if not any(c.isalpha() for c in prompt) and any(op in prompt for op in '+-*/'):
+                 math_expr = prompt
+             else:
+                raise ValueError("Could not perform calculation: No calculation expression found after 'calculate'.")
+        else:
+            math_expr = parts[1].strip()
+        return self._evaluate_expression(math_expr)
+
+    def _evaluate_expression(self, math_expr: str) -> str:
         # This remains synchronous as eval is usually very fast
         # and running it in executor adds overhead negligible for simple math.
         # WARNING: eval is inherently unsafe if the input isn't strictly controlled!
         try:
-            # Slightly improved extraction - find 'calculate' and take text after it
-            parts = prompt.lower().split("calculate", 1)
-            if len(parts) < 2:
-                 # Try basic check if the prompt itself looks like an expression
-                 if not any(c.isalpha() for c in prompt) and any(op in prompt for op in '+-*/'):
-                     math_expr = prompt
-                 else:
-                    raise ValueError("No calculation expression found after 'calculate'.")
-            else:
-                math_expr = parts[1].strip()
-
             # Sanitize further - remove any potential harmful characters beyond basic math
             allowed_chars = set("0123456789+-*/.() ")
             sanitized_expr = "".join(c for c in math_expr if c in allowed_chars)
@@ -260,7 +713,7 @@ class EnhancedLlama:
 # It's often better to initialize this within your FastAPI app startup event
 # to handle errors gracefully, but this works for a simple script.
 try:
-    MODEL_PATH = "app/models/llama-2-7b-chat.Q4_K_M.gguf" # Ensure this path is correct
+    MODEL_PATH = os.getenv("LLAMA_MODEL_PATH", "app/models/llama-2-7b-chat.Q4_K_M.gguf") # Ensure this path is correct
     if not os.path.exists(MODEL_PATH):
          raise FileNotFoundError(f"Model file not found at: {MODEL_PATH}")
     llm_engine = EnhancedLlama(model_path=MODEL_PATH)
@@ -1,29 +1,28 @@
 #main.py
-from fastapi import FastAPI, HTTPException,Depends,APIRouter,Body,Request
+from fastapi import FastAPI, HTTPException,Depends,APIRouter,Body,Request,Response
 from sqlalchemy.orm import Session
 from . import models, database, security,crud
 from pydantic import BaseModel
-from .security import get_current_user
+from .security import get_current_user, get_current_user_optional
+from .quotas import quota_manager, usage_accountant, record_llm_usage
 from .models import User
 from fastapi.middleware.cors import CORSMiddleware
 from .database import get_db,engine
 from app import schemas
 from app.llama_engine import llm_engine
-from fastapi.responses import StreamingResponse
-import io
 import os
 import requests
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-from elevenlabs import Voice, VoiceSettings
 import logging
 
 
-from . import weather,news
+from . import weather,news,chat_ws,tts
+from .http_cache import conditional_json
+from .upstream_cache import cache_warmer
 
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import Optional
+from typing import Optional, Literal
 
 
 load_dotenv()
@@ -33,6 +32,7 @@ logger = logging.getLogger("uvicorn.error")
 models.Base.metadata.create_all(bind=engine)
 app.include_router(weather.router)
 app.include_router(news.router)
+app.include_router(chat_ws.router)
 
 
 app.add_middleware(
@@ -44,19 +44,85 @@ app.add_middleware(
 )
 
 llm = None
-client = ElevenLabs(api_key="sk_e6eb688be88f1399430f675260169c7184dadba119ccef70")  
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    usage_accountant.start()
+    cache_warmer.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await usage_accountant.stop()  # Writes any usage not yet flushed
+    await cache_warmer.stop()
 
 
 #llama
+def llm_user_key(request: Request, user: Optional[User]):
+    """Key for token budgets and fair-share queueing; anonymous callers are keyed by address"""
+    if user is not None:
+        return user.id
+    return f"anon:{request.client.host if request.client else 'unknown'}"
+
 @app.post("/chat/")
-async def chat(prompt: str = Body(..., embed=True)):
+async def chat(
+    request: Request,
+    response: Response,
+    prompt: str = Body(..., embed=True),
+    speculative: Optional[bool] = Body(None, embed=True),
+    tool_mode: Optional[Literal["keywords", "grammar"]] = Body(None, embed=True),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+):
     """Handle chat requests synchronously"""
+    user_key = llm_user_key(request, current_user)
+    # 429 with Retry-After once the token budget is spent; otherwise an upper estimate is held until the reply is done
+    reserved = quota_manager.reserve(user_key, llm_engine.reservation(prompt, tool_mode=tool_mode) if llm_engine else 0)
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
     try:
-        response = await llm_engine.generate_response(prompt)  # Sync call
-        return {"response": response}
+        # speculative=None -> deployment default (LLAMA_SPECULATIVE_DEFAULT)
+        # Generation is abandoned at the next token if the client disconnects
+        reply = await llm_engine.generate_response(
+            prompt,
+            speculative=speculative,
+            is_disconnected=request.is_disconnected,
+            user_key=user_key,
+            usage=usage,
+            tool_mode=tool_mode,  # None -> LLAMA_TOOL_MODE
+        )
+        return {"response": reply}
+    except HTTPException:
+        raise  # 504 on deadline, 499 on disconnect
     except Exception as e:
         logger.error(f"Chat endpoint error: {str(e)}")
         return {"error": str(e)}
+    finally:
+        record_llm_usage(current_user.id if current_user else None, user_key, usage, reserved)
+        response.headers["X-Token-Usage-Prompt"] = str(usage["prompt_tokens"])
+        response.headers["X-Token-Usage-Completion"] = str(usage["completion_tokens"])
+        response.headers.update(quota_manager.headers(user_key))
+
+@app.get("/usage/")
+def get_usage(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Lifetime token usage (including not yet flushed usage) and remaining budget"""
+    stored = db.query(models.TokenUsage).filter(models.TokenUsage.user_id == current_user.id).first()
+    pending_prompt, pending_completion = usage_accountant.pending(current_user.id)
+    return {
+        "prompt_tokens": (stored.prompt_tokens if stored else 0) + pending_prompt,
+        "completion_tokens": (stored.completion_tokens if stored else 0) + pending_completion,
+        "rate_limit": quota_manager.headers(current_user.id),
+    }
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Inference counters: completed/cancelled/dropped requests and wasted tokens"""
+    if llm_engine is None:
+        raise HTTPException(status_code=503, detail="LLM engine not loaded")
+    return {**llm_engine.inference_stats, "queued": llm_engine.scheduler.waiting, **llm_engine.decoding_stats()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Weather/news cache hits, misses, warmer refreshes and the current hot keys"""
+    return cache_warmer.snapshot()
     
 
 #elevenlabs
@@ -65,36 +131,19 @@ class TTSRequest(BaseModel):
     voice_id: str = "EXAVITQu4vr4xnSDxMaL"  
     stability: float = 0.7
     similarity_boost: float = 0.7
+    format: Optional[str] = None  # e.g. "mp3_22050_32", "opus", "wav"; None -> negotiated from Accept
 
 @app.post("/tts")
-async def text_to_speech(request: TTSRequest):
-    """Endpoint for text-to-speech conversion"""
-    try:
-        audio_stream = client.generate(
-            text=request.text,
-            voice=Voice(
-                voice_id=request.voice_id,
-                settings=VoiceSettings(
-                    stability=request.stability,
-                    similarity_boost=request.similarity_boost
-                )
-            ),
-            stream=True
-        )
-        
-        audio_bytes = io.BytesIO()
-        for chunk in audio_stream:
-            if chunk:
-                audio_bytes.write(chunk)
-        audio_bytes.seek(0)
-        
-        return StreamingResponse(
-            audio_bytes,
-            media_type="audio/mpeg",
-            headers={"Content-Disposition": "attachment; filename=tts_output.mp3"}
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def text_to_speech(request: Request, body: TTSRequest, format: Optional[str] = None):
+    """Endpoint for text-to-speech conversion; audio is streamed in the negotiated format"""
+    output_format = tts.negotiate_format(body.format or format, request.headers.get("accept"))
+    return await tts.text_to_speech(
+        text=body.text,
+        voice_id=body.voice_id,
+        stability=body.stability,
+        similarity_boost=body.similarity_boost,
+        output_format=output_format,
+    )
 
 ########################################################################
 # Dependency to get DB session
@@ -159,6 +208,7 @@ def save_conversation(conversation: ConversationCreate, db: Session = Depends(ge
     # Create new conversation history entry
     db_conversation = models.ConversationHistory(user_id=current_user.id, message=conversation.message, response=conversation.response)
     db.add(db_conversation)
+    crud.bump_version(db, current_user.id, "conversations")
     db.commit()
     db.refresh(db_conversation)
     return {"msg": "Conversation saved successfully"}
@@ -169,11 +219,14 @@ class ConversationResponse(BaseModel):
     response: str
     timestamp: str
 
-@app.get("/get_conversations/") #retrieves a list of conversations for the current user
-def get_conversations(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Retrieve all conversations for the current user
-    conversations = db.query(models.ConversationHistory).filter(models.ConversationHistory.user_id == current_user.id).all()
-    return [ConversationResponse(message=conv.message, response=conv.response, timestamp=conv.timestamp.isoformat()) for conv in conversations]
+@app.get("/get_conversations/", response_model=list[ConversationResponse]) #retrieves a list of conversations for the current user
+def get_conversations(request: Request, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Unchanged history (same watermark as the client's ETag) is answered with 304 without loading it
+    def load():
+        rows = db.query(models.ConversationHistory.message, models.ConversationHistory.response, models.ConversationHistory.timestamp).filter(
+            models.ConversationHistory.user_id == current_user.id).all()
+        return [{"message": row.message, "response": row.response, "timestamp": row.timestamp.isoformat()} for row in rows]
+    return conditional_json(request, crud.resource_etag(db, current_user.id, "conversations"), load)
 
 # Pydantic model for adding tasks
 class TaskCreate(BaseModel):
@@ -184,6 +237,7 @@ def add_task(task: schemas.TaskCreate, db: Session = Depends(get_db), current_us
     # Create new task entry
     db_task = models.Task(user_id=current_user.id, task_name=task.task_name)
     db.add(db_task)
+    crud.bump_version(db, current_user.id, "tasks")
     db.commit()
     db.refresh(db_task)
     return {"msg": "Task added successfully"}
@@ -194,11 +248,13 @@ class TaskResponse(BaseModel):
     completed: bool
     timestamp: str
 
-@app.get("/get_tasks/")#retrieves all tasks for the current user 
-def get_tasks(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Retrieve all tasks for the current user
-    tasks = db.query(models.Task).filter(models.Task.user_id == current_user.id).all()
-    return [TaskResponse(task_name=task.task_name, completed=bool(task.completed), timestamp=task.timestamp.isoformat()) for task in tasks]
+@app.get("/get_tasks/", response_model=list[TaskResponse])#retrieves all tasks for the current user 
+def get_tasks(request: Request, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Unchanged tasks (same watermark as the client's ETag) are answered with 304 without loading them
+    def load():
+        rows = db.query(models.Task.task_name, models.Task.completed, models.Task.timestamp).filter(models.Task.user_id == current_user.id).all()
+        return [{"task_name": row.task_name, "completed": bool(row.completed), "timestamp": row.timestamp.isoformat()} for row in rows]
+    return conditional_json(request, crud.resource_etag(db, current_user.id, "tasks"), load)
 
 @app.post("/complete_task/{task_id}")#marks a specific tasks as completed
 def complete_task(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -208,6 +264,7 @@ def complete_task(task_id: int, db: Session = Depends(get_db), current_user: Use
         raise HTTPException(status_code=404, detail="Task not found")
 
     db_task.completed = 1
+    crud.bump_version(db, current_user.id, "tasks")
     db.commit()
     db.refresh(db_task)
     return {"msg": "Task marked as completed"}
@@ -219,7 +276,8 @@ def edit_task(
     task_id: int, task: schemas.TaskUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)
 ):
     db_task = crud.get_task(db, task_id)
-    if db_task and db_task.owner_id == current_user.id:
+    if db_task and db_task.user_id == current_user.id:
+        crud.bump_version(db, current_user.id, "tasks")  # Committed by update_task
         return crud.update_task(db, task_id, task)
     else:
         raise HTTPException(status_code=404, detail="Task not found or not authorized")
@@ -236,7 +294,8 @@ def update_task(db: Session, task_id: int, task: schemas.TaskUpdate):
 @app.delete("/delete_task/{task_id}")
 def delete_task(task_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     db_task = crud.get_task(db, task_id)
-    if db_task and db_task.owner_id == current_user.id:
+    if db_task and db_task.user_id == current_user.id:
+        crud.bump_version(db, current_user.id, "tasks")  # Committed by delete_task
         crud.delete_task(db, task_id)
         return {"msg": "Task deleted successfully"}
     else:
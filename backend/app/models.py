@@ -11,6 +11,7 @@ class User(Base):
     hashed_password = Column(String(128))
     conversations = relationship("ConversationHistory", back_populates="user")
     tasks = relationship("Task", back_populates="user")
+    token_usage = relationship("TokenUsage", back_populates="user", uselist=False)
 
 class ConversationHistory(Base):
     __tablename__ = "conversation_history"
@@ -30,3 +31,20 @@ class Task(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="tasks")
+
+class TokenUsage(Base):
+    __tablename__ = "token_usage"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User", back_populates="token_usage")
+
+# Change counter per user collection ("tasks", "conversations"), used as an ETag watermark
+class ResourceVersion(Base):
+    __tablename__ = "resource_versions"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    resource = Column(String(32), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -1,12 +1,24 @@
 # backend/app/news.py
 import os
-import requests
-from fastapi import APIRouter, HTTPException
+import asyncio
+import httpx
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from .http_cache import json_response
+from .upstream_cache import UpstreamCache, cache_warmer
 
 router = APIRouter()
 
+NEWS_API_BASE_URL = os.getenv("NEWS_API_BASE_URL", "https://newsapi.org")
+NEWS_CACHE_CONTROL = os.getenv("NEWS_CACHE_CONTROL", "public, max-age=120, stale-while-revalidate=300")
+NEWS_CACHE_TTL = float(os.getenv("NEWS_CACHE_TTL", "300"))
+# Upstream budget shared by cache misses and the warmer; set it to your NewsAPI plan
+NEWS_RATE_PER_MINUTE = float(os.getenv("NEWS_RATE_PER_MINUTE", "10"))
+NEWS_MAX_CONCURRENCY = int(os.getenv("NEWS_MAX_CONCURRENCY", "2"))
+
+_client = httpx.AsyncClient(timeout=10.0)
+
 # List of supported country codes (NewsAPI supports ~50 countries)
 SUPPORTED_COUNTRIES = {
     'ae', 'ar', 'at', 'au', 'be', 'bg', 'br', 'ca', 'ch', 'cn', 
@@ -31,6 +43,29 @@ def validate_country(country: str):
         )
     return country.lower()
 
+async def fetch_headlines(key: Tuple[str, str, str]) -> List[dict]:
+    """Top headlines for one (country, category, keywords) key, straight from NewsAPI"""
+    country, topic, keywords = key
+    params = {"country": country, "category": topic, "apiKey": os.getenv("NEWS_API_KEY")}
+    if keywords:
+        params["q"] = keywords
+
+    response = await _client.get(f"{NEWS_API_BASE_URL}/v2/top-headlines", params=params)
+    response.raise_for_status()
+    return [
+        {
+            "title": article["title"],
+            "source": article["source"]["name"],
+            "url": article["url"],
+            "country": country,  # Add which country this came from
+            "publishedAt": article.get("publishedAt") or "",
+        } for article in response.json().get("articles", [])
+    ]
+
+news_cache = cache_warmer.register(UpstreamCache(
+    "newsapi", fetch_headlines, NEWS_CACHE_TTL, NEWS_RATE_PER_MINUTE, NEWS_MAX_CONCURRENCY
+))
+
 @router.post("/news/")
 async def get_news(request: NewsRequest):
     API_KEY = os.getenv("NEWS_API_KEY")
@@ -45,39 +80,40 @@ async def get_news(request: NewsRequest):
         else:
             countries_to_fetch = [validate_country(request.country)]
         
-        all_articles = []
-        
-        for country in countries_to_fetch:
-            url = f"https://newsapi.org/v2/top-headlines?country={country}&category={request.topic}&apiKey={API_KEY}"
-            
-            if request.keywords:
-                url += f"&q={request.keywords}"
-            
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            articles = response.json().get("articles", [])
-            all_articles.extend(articles)
+        # One cache entry per country, so multi-country requests share them with single-country ones
+        keywords = (request.keywords or "").strip().lower()
+        results = await asyncio.gather(
+            *(news_cache.get((country, request.topic.strip().lower(), keywords)) for country in countries_to_fetch)
+        )
+        all_articles = [article for articles in results for article in articles]
         
         # Sort by newest first and get top 3
         sorted_articles = sorted(
             all_articles,
-            key=lambda x: x.get('publishedAt', ''),
+            key=lambda x: x['publishedAt'],
             reverse=True
         )[:3]
         
         return {
             "articles": [
-                {
-                    "title": article["title"],
-                    "source": article["source"]["name"],
-                    "url": article["url"],
-                    "country": country  # Add which country this came from
-                } for article in sorted_articles
+                {key: article[key] for key in ("title", "source", "url", "country")}
+                for article in sorted_articles
             ]
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"News unavailable: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=f"News unavailable: {str(e)}")
+
+@router.get("/news/")
+async def read_news(
+    request: Request,
+    topic: str = "general",
+    country: str = "us",
+    countries: Optional[List[str]] = Query(None),
+    keywords: Optional[str] = None,
+):
+    """Cacheable variant of POST /news/ with ETag and Cache-Control headers"""
+    data = await get_news(NewsRequest(topic=topic, country=country, countries=countries, keywords=keywords))
+    return json_response(request, data, NEWS_CACHE_CONTROL)
@@ -0,0 +1,193 @@
+# app/quotas.py
+"""Per-user token accounting and token-bucket rate limits for LLM work."""
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import update
+
+from . import database, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_USERS = 10000 # Prune full buckets beyond this many users
+
+
+class TokenBucket:
+    """Token bucket over LLM tokens.
+
+    A request may start whenever the balance is positive. It is charged an upper
+    estimate on admission and settled to its real usage afterwards, so the balance
+    can go negative and the debt is paid back by refill before the next request is
+    admitted.
+    """
+
+    def __init__(self, capacity: float, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_sec)
+        self.updated = now
+
+    def remaining(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def charge(self, tokens: int):
+        """Take `tokens` from the balance; a negative amount refunds, up to capacity."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - tokens)
+
+    def retry_after(self) -> float:
+        """Seconds until the balance is positive again."""
+        deficit = -self.remaining()
+        return max(0.0, deficit / self.refill_per_sec) if self.refill_per_sec else float("inf")
+
+
+class QuotaManager:
+    def __init__(self, tokens_per_minute: int, burst: int = 0):
+        self.tokens_per_minute = tokens_per_minute # 0 disables limiting
+        self.burst = burst or tokens_per_minute
+        self._buckets: Dict[Any, TokenBucket] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.tokens_per_minute > 0
+
+    def bucket(self, key: Any) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                # A full bucket is indistinguishable from a new one, so it can go
+                self._buckets = {k: b for k, b in self._buckets.items() if b.remaining() < b.capacity}
+            bucket = self._buckets[key] = TokenBucket(self.burst, self.tokens_per_minute / 60)
+        return bucket
+
+    def check(self, key: Any):
+        """Raise 429 if `key` has exhausted its token budget."""
+        if not self.enabled:
+            return
+        bucket = self.bucket(key)
+        if bucket.remaining() <= 0:
+            retry_after = bucket.retry_after()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Token rate limit exceeded",
+                headers={"Retry-After": str(int(retry_after) + 1), **self.headers(key)},
+            )
+
+    def reserve(self, key: Any, tokens: int) -> int:
+        """Admit a request (see check) and hold `tokens` of budget for it; returns the amount held.
+
+        Holding the estimate up front stops concurrent requests from all being admitted
+        against one positive balance. Pass the returned amount to record_llm_usage.
+        """
+        self.check(key)
+        if not self.enabled:
+            return 0
+        self.bucket(key).charge(tokens)
+        return tokens
+
+    def charge(self, key: Any, tokens: int):
+        if self.enabled and tokens:
+            self.bucket(key).charge(tokens)
+
+    def headers(self, key: Any) -> Dict[str, str]:
+        if not self.enabled:
+            return {}
+        bucket = self.bucket(key)
+        return {
+            "X-RateLimit-Limit-Tokens": str(self.tokens_per_minute),
+            "X-RateLimit-Remaining-Tokens": str(max(0, int(bucket.remaining()))),
+            "X-RateLimit-Reset-Tokens": str(int(bucket.retry_after()) + 1 if bucket.remaining() <= 0 else 0),
+        }
+
+
+class UsageAccountant:
+    """Aggregates token usage in memory and writes it to the DB in batches."""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: int, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            p, c = self._pending.get(user_id, (0, 0))
+            self._pending[user_id] = (p + prompt_tokens, c + completion_tokens)
+
+    def pending(self, user_id: int) -> Tuple[int, int]:
+        with self._lock:
+            return self._pending.get(user_id, (0, 0))
+
+    def flush(self):
+        """Write pending usage in one transaction (blocking)."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+
+        db = database.SessionLocal()
+        try:
+            now = datetime.utcnow()
+            for user_id, (p, c) in batch.items():
+                result = db.execute(
+                    update(models.TokenUsage)
+                    .where(models.TokenUsage.user_id == user_id)
+                    .values(
+                        prompt_tokens=models.TokenUsage.prompt_tokens + p,
+                        completion_tokens=models.TokenUsage.completion_tokens + c,
+                        updated_at=now,
+                    )
+                )
+                if result.rowcount == 0:
+                    db.add(models.TokenUsage(user_id=user_id, prompt_tokens=p, completion_tokens=c, updated_at=now))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Token usage flush failed, will retry: {e}")
+            for user_id, (p, c) in batch.items():
+                self.record(user_id, p, c)
+        finally:
+            db.close()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(None, self.flush)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+
+def record_llm_usage(user_id: Optional[int], key: Any, usage: Dict[str, int], reserved: int = 0):
+    """Charge `usage` to the rate limit for `key` and, for signed-in users, to their lifetime totals.
+
+    `reserved` is what QuotaManager.reserve held on admission; only the difference is charged.
+    """
+    tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+    quota_manager.charge(key, tokens - reserved)
+    if user_id is not None and tokens:
+        usage_accountant.record(user_id, usage["prompt_tokens"], usage["completion_tokens"])
+
+
+quota_manager = QuotaManager(settings.USER_TOKENS_PER_MINUTE, settings.USER_TOKEN_BURST)
+usage_accountant = UsageAccountant(settings.USAGE_FLUSH_SECONDS)
@@ -0,0 +1,98 @@
+# app/scheduler.py
+"""Fair-share dispatch of LLM work across users.
+
+Each user has a virtual time: the number of tokens the model has spent on them.
+When a slot frees up, the waiting user with the lowest virtual time goes next,
+so a user sending back-to-back long prompts cannot starve everyone else.
+Users arriving from idle start at the current virtual clock, so idle time does
+not turn into credit.
+"""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict
+
+MAX_TRACKED_USERS = 10000 # Prune idle virtual times beyond this many users
+
+
+class SlotTicket:
+    """Handed to the holder of a slot; call charge() with the tokens the work used."""
+
+    def __init__(self):
+        self.cost = 0
+
+    def charge(self, tokens: int):
+        self.cost += tokens
+
+
+class FairScheduler:
+    def __init__(self, slots: int = 1):
+        self._free = slots
+        self._queues: Dict[Any, Deque[asyncio.Future]] = {}
+        self._vtime: Dict[Any, float] = {}
+        self._clock = 0.0 # Virtual time of the most recently dispatched user
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, key: Any):
+        """Wait for a model slot in fair-share order for `key`."""
+        await self._acquire(key)
+        ticket = SlotTicket()
+        try:
+            yield ticket
+        finally:
+            self._release(key, ticket.cost)
+
+    async def _acquire(self, key: Any):
+        # Idle users join at the current clock instead of keeping an old, low virtual time
+        self._vtime[key] = max(self._vtime.get(key, 0.0), self._clock)
+        if self._free > 0 and not self._queues:
+            self._free -= 1
+            self._clock = self._vtime[key]
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just as we were cancelled: pass it on
+                self._release(key, 0)
+            else:
+                self._discard(key, future)
+            raise
+
+    def _release(self, key: Any, cost: float):
+        self._vtime[key] = self._vtime.get(key, self._clock) + cost
+        self._free += 1
+        self._dispatch()
+        if len(self._vtime) > MAX_TRACKED_USERS:
+            self._vtime = {k: v for k, v in self._vtime.items() if v > self._clock or k in self._queues}
+
+    def _dispatch(self):
+        while self._free > 0 and self._queues:
+            key = min(self._queues, key=lambda k: self._vtime.get(k, self._clock))
+            queue = self._queues[key]
+            future = queue.popleft()
+            if not queue:
+                del self._queues[key]
+            if future.done():
+                continue
+            self._free -= 1
+            self._clock = max(self._clock, self._vtime.get(key, self._clock))
+            future.set_result(None)
+
+    def _discard(self, key: Any, future: asyncio.Future):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[key]
@@ -5,7 +5,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from . import models, database, config
-from typing import Annotated
+from typing import Annotated, Optional
 import logging
 
 # Configure logging
@@ -13,6 +13,7 @@ logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -39,6 +40,10 @@ async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
     db: Annotated[Session, Depends(database.get_db)]
 ) -> models.User:
+    return user_from_token(token, db)
+
+def user_from_token(token: str, db: Session) -> models.User:
+    """Decode a bearer token and load its user; raises 401 if either fails."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
@@ -60,4 +65,13 @@ async def get_current_user(
     user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+async def get_current_user_optional(
+    token: Annotated[Optional[str], Depends(optional_oauth2_scheme)],
+    db: Annotated[Session, Depends(database.get_db)]
+) -> Optional[models.User]:
+    """Like get_current_user, but returns None for anonymous requests."""
+    if token is None:
+        return None
+    return await get_current_user(token, db)
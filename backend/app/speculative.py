@@ -0,0 +1,91 @@
+# app/speculative.py
+"""Draft models for speculative decoding with llama_cpp.
+
+llama_cpp verifies drafted tokens against the main model, so greedy (temperature 0)
+output is identical with or without a draft; only the decode speed changes.
+"""
+import threading
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+DRAFT_MODES = ("off", "prompt_lookup", "draft_model")
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Greedy drafts from a small GGUF model that shares the main model's vocabulary."""
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 4, n_ctx: int = 2048, n_threads: Optional[int] = None):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        if len(input_ids) + self.num_pred_tokens >= self.llm.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        draft = []
+        # generate() reuses the longest cached prefix, so only new tokens are evaluated
+        for token in self.llm.generate(input_ids.tolist(), temp=0.0, top_k=1):
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+class CountingDraftModel(LlamaDraftModel):
+    """Wraps a draft model and counts draft calls and drafted tokens.
+
+    Each draft call corresponds to one verification step of the main model, so
+    accepted tokens can be estimated as completion_tokens - (steps + 1).
+    """
+
+    def __init__(self, inner: LlamaDraftModel):
+        self.inner = inner
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.drafted_tokens = 0
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        draft = self.inner(input_ids, **kwargs)
+        with self._lock:
+            self.calls += 1
+            self.drafted_tokens += len(draft)
+        return draft
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "drafted_tokens": self.drafted_tokens}
+
+
+def build_draft_model(
+    mode: str,
+    draft_model_path: Optional[str] = None,
+    num_pred_tokens: Optional[int] = None,
+    n_ctx: int = 2048,
+    n_threads: Optional[int] = None,
+) -> Optional[CountingDraftModel]:
+    """Create the draft model for a decoding mode ('off' returns None)."""
+    if mode == "off":
+        return None
+    if mode == "prompt_lookup":
+        return CountingDraftModel(LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens or 10))
+    if mode == "draft_model":
+        if not draft_model_path:
+            raise ValueError("draft_model mode requires a draft model path (LLAMA_DRAFT_MODEL_PATH)")
+        return CountingDraftModel(GGUFDraftModel(draft_model_path, num_pred_tokens or 4, n_ctx, n_threads))
+    raise ValueError(f"Unknown draft mode '{mode}'. Choose from: {DRAFT_MODES}")
+
+
+def acceptance_rate(completion_tokens: int, before: dict, after: dict) -> Optional[float]:
+    """Estimate the fraction of drafted tokens the main model accepted between two snapshots."""
+    steps = after["calls"] - before["calls"]
+    drafted = after["drafted_tokens"] - before["drafted_tokens"]
+    if drafted <= 0:
+        return None
+    accepted = max(0, completion_tokens - (steps + 1))
+    return min(1.0, accepted / drafted)
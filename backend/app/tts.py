@@ -4,56 +4,276 @@ from fastapi.responses import StreamingResponse
 from .config import settings
 from pathlib import Path
 import hashlib
+import json
 import os
-from typing import Optional
+import re
+import struct
+import tempfile
+from functools import partial
+from typing import IO, AsyncIterator, Dict, Iterable, Iterator, Optional
 
-CACHE_DIR = Path("tts_cache")
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "tts_cache"))
 CACHE_DIR.mkdir(exist_ok=True)
 
+VOICE_ID_PATTERN = re.compile(r"[A-Za-z0-9]+") # ElevenLabs voice ids; keeps the upstream URL path fixed
+
+ELEVEN_BASE_URL = os.getenv("ELEVEN_BASE_URL", "https://api.elevenlabs.io")
+# One model for every TTS path (the SDK default); part of the cache key
+ELEVEN_MODEL_ID = os.getenv("ELEVEN_MODEL_ID", "eleven_multilingual_v2")
+
+# Output formats: ElevenLabs output_format, media type and file extension.
+# wav_* is PCM behind a streaming WAV header, so browsers can play it without a decoder.
+AUDIO_FORMATS: Dict[str, Dict[str, str]] = {
+    **{f"mp3_{rate}": {"upstream": f"mp3_{rate}", "media_type": "audio/mpeg", "ext": "mp3"}
+       for rate in ("22050_32", "44100_32", "44100_64", "44100_96", "44100_128", "44100_192")},
+    **{f"opus_48000_{kbps}": {"upstream": f"opus_48000_{kbps}", "media_type": "audio/ogg; codecs=opus", "ext": "ogg"}
+       for kbps in (32, 64, 96, 128)},
+    **{f"pcm_{hz}": {"upstream": f"pcm_{hz}", "media_type": f"audio/L16; rate={hz}; channels=1", "ext": "pcm"}
+       for hz in (16000, 22050, 24000, 44100)},
+    **{f"wav_{hz}": {"upstream": f"pcm_{hz}", "media_type": "audio/wav", "ext": "wav"}
+       for hz in (16000, 22050, 24000, 44100)},
+}
+FORMAT_ALIASES = {
+    "mp3": "mp3_44100_128", # Provider default
+    "mp3_low": "mp3_22050_32", # Speech-grade, about a quarter of the default size
+    "opus": "opus_48000_64",
+    "pcm": "pcm_24000",
+    "wav": "wav_24000",
+}
+DEFAULT_FORMAT = "mp3_44100_128"
+
+# Accept media types -> format, for clients that negotiate instead of naming one
+ACCEPT_FORMATS = {
+    "audio/mpeg": "mp3_44100_128",
+    "audio/mp3": "mp3_44100_128",
+    "audio/ogg": "opus_48000_64",
+    "audio/opus": "opus_48000_64",
+    "audio/webm": "opus_48000_64",
+    "audio/l16": "pcm_24000",
+    "audio/pcm": "pcm_24000",
+    "audio/wav": "wav_24000",
+    "audio/wave": "wav_24000",
+    "audio/x-wav": "wav_24000",
+    "audio/*": DEFAULT_FORMAT,
+    "*/*": DEFAULT_FORMAT,
+}
+
+COMPRESSED_FRAME_BYTES = 4096 # Chunk size for MP3/Opus; players resync on frame headers
+PCM_FRAME_MS = 40 # PCM chunks hold whole 16-bit samples, this many ms each
+
+_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+
+
+def negotiate_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """Format named by the request, else the best match for the Accept header.
+
+    Raises 400 for an unknown requested format and 406 if nothing in Accept is supported.
+    """
+    if requested:
+        name = FORMAT_ALIASES.get(requested, requested)
+        if name not in AUDIO_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported format '{requested}'. Choose from: {sorted(FORMAT_ALIASES) + sorted(AUDIO_FORMATS)}"
+            )
+        return name
+    if not accept:
+        return DEFAULT_FORMAT
+
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        name = ACCEPT_FORMATS.get(media_type.lower())
+        if name and q > 0:
+            candidates.append((-q, position, name))
+    if not candidates:
+        raise HTTPException(status_code=406, detail=f"No supported audio type in Accept. Supported: {sorted(ACCEPT_FORMATS)}")
+    return min(candidates)[2]
+
+
+def _sample_rate(fmt: str) -> int:
+    return int(AUDIO_FORMATS[fmt]["upstream"].split("_")[1])
+
+
+def _frame_bytes(fmt: str) -> int:
+    if AUDIO_FORMATS[fmt]["upstream"].startswith("pcm_"):
+        return _sample_rate(fmt) * 2 * PCM_FRAME_MS // 1000 # 16-bit mono
+    return COMPRESSED_FRAME_BYTES
+
+
+def wav_header(sample_rate: int) -> bytes:
+    """WAV header for 16-bit mono PCM of unknown length (sizes set to the maximum, as streaming players expect)."""
+    unknown = 0xFFFFFFFF
+    return (
+        b"RIFF" + struct.pack("<I", unknown) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+        + b"data" + struct.pack("<I", unknown)
+    )
+
+
+async def _frames(chunks: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    """Re-chunk a byte stream into `size`-byte frames (the last one may be shorter)."""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _file_frames(path: Path, size: int) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        while frame := f.read(size):
+            yield frame
+
+
+def _cache_path(text: str, voice_id: str, stability: float, similarity_boost: float, fmt: str) -> Path:
+    key = json.dumps([text, voice_id, ELEVEN_MODEL_ID, stability, similarity_boost, AUDIO_FORMATS[fmt]["upstream"]])
+    path = (CACHE_DIR / f"{hashlib.md5(key.encode()).hexdigest()}.{AUDIO_FORMATS[fmt]['ext']}").resolve()
+    if path.parent != CACHE_DIR.resolve():
+        raise HTTPException(status_code=400, detail="Invalid TTS cache key")
+    return path
+
+
+def _discard(part: IO[bytes]) -> None:
+    """Close and delete an unpublished cache file, ignoring errors."""
+    try:
+        part.close()
+        os.unlink(part.name)
+    except OSError:
+        pass
+
+
+class _UpstreamStreamingResponse(StreamingResponse):
+    """Streams audio from an open upstream response and always releases it.
+
+    A generator that never starts never runs its finally block, so a client that
+    disconnects before the body begins would otherwise leak the connection.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], upstream: httpx.Response, **kwargs):
+        super().__init__(content, **kwargs)
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+
+def _audio_response(frames: Iterable[bytes], fmt: str, cached: bool, upstream: Optional[httpx.Response] = None) -> StreamingResponse:
+    response_class = StreamingResponse if upstream is None else partial(_UpstreamStreamingResponse, upstream=upstream)
+    return response_class(
+        frames,
+        media_type=AUDIO_FORMATS[fmt]["media_type"],
+        headers={
+            "Content-Disposition": f"inline; filename=tts_output.{AUDIO_FORMATS[fmt]['ext']}",
+            "X-Audio-Format": fmt,
+            "X-TTS-Cache": "hit" if cached else "miss",
+            "Vary": "Accept",
+        },
+    )
+
+
 async def text_to_speech(
     text: str,
-    voice_id: str = "Rachel",
+    voice_id: str = "EXAVITQu4vr4xnSDxMaL",
     stability: float = 0.5,
     similarity_boost: float = 0.75,
-    use_cache: bool = True
+    use_cache: bool = True,
+    output_format: str = DEFAULT_FORMAT,
 ) -> StreamingResponse:
-    """Generate or fetch cached TTS audio."""
-    # Create cache key
-    text_hash = hashlib.md5(text.encode()).hexdigest()
-    cache_file = CACHE_DIR / f"{voice_id}_{text_hash}.mp3"
+    """Stream TTS audio in `output_format` (see negotiate_format), from the cache when possible.
 
-    # Return cached audio if available
+    Audio is forwarded in fixed-size frames as ElevenLabs produces it, so playback
+    can start before synthesis ends, and is cached once the stream completes.
+    """
+    if not VOICE_ID_PATTERN.fullmatch(voice_id):
+        raise HTTPException(status_code=400, detail="voice_id must be alphanumeric")
+    fmt = output_format
+    cache_file = _cache_path(text, voice_id, stability, similarity_boost, fmt)
+    header = wav_header(_sample_rate(fmt)) if AUDIO_FORMATS[fmt]["ext"] == "wav" else b""
+
+    # Return cached audio if available (wav is cached with its header)
     if use_cache and cache_file.exists():
-        return StreamingResponse(cache_file.open("rb"), media_type="audio/mpeg")
-
-    # Call ElevenLabs API
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    headers = {
-        "xi-api-key": settings.ELEVEN_API_KEY,
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "text": text,
-        "model_id": "eleven_monolingual_v1",
-        "voice_settings": {
-            "stability": stability,
-            "similarity_boost": similarity_boost,
-        }
-    }
-
-    async with httpx.AsyncClient() as client:
+        return _audio_response(_file_frames(cache_file, _frame_bytes(fmt)), fmt, cached=True)
+
+    # Call ElevenLabs API; the status is checked before the response starts so errors keep their code
+    request = _client.build_request(
+        "POST",
+        f"{ELEVEN_BASE_URL}/v1/text-to-speech/{voice_id}/stream",
+        params={"output_format": AUDIO_FORMATS[fmt]["upstream"]},
+        headers={"xi-api-key": settings.ELEVEN_API_KEY, "Content-Type": "application/json"},
+        json={
+            "text": text,
+            "model_id": ELEVEN_MODEL_ID,
+            "voice_settings": {
+                "stability": stability,
+                "similarity_boost": similarity_boost,
+            }
+        },
+    )
+    try:
+        response = await _client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"ElevenLabs API unreachable: {e}")
+    if response.is_error:
+        body = await response.aread()
+        await response.aclose()
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"ElevenLabs API error: {body.decode(errors='replace')}"
+        )
+
+    async def stream() -> AsyncIterator[bytes]:
+        # Caching is best effort: a disk error drops the cache copy, never the response.
+        # Each stream writes its own temp file, so concurrent misses for a key don't collide.
+        out = None
+        if use_cache:
+            try:
+                out = tempfile.NamedTemporaryFile(dir=CACHE_DIR, prefix=cache_file.name + ".", suffix=".part", delete=False)
+            except OSError:
+                pass
+
+        def cache(data: bytes):
+            nonlocal out
+            if out is None:
+                return
+            try:
+                out.write(data)
+            except OSError:
+                _discard(out)
+                out = None
+
+        complete = False
         try:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            # Cache the audio
-            audio_data = response.content
-            with cache_file.open("wb") as f:
-                f.write(audio_data)
-            
-            return StreamingResponse(io.BytesIO(audio_data), media_type="audio/mpeg")
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=e.response.status_code,
-                detail=f"ElevenLabs API error: {e.response.text}"
-            )
\ No newline at end of file
+            if header:
+                cache(header)
+                yield header
+            async for frame in _frames(response.aiter_bytes(), _frame_bytes(fmt)):
+                cache(frame)
+                yield frame
+            complete = True
+        finally:
+            await response.aclose()
+            if out is not None:
+                if complete:
+                    try:
+                        out.close()
+                        os.replace(out.name, cache_file) # Only complete audio becomes visible to readers
+                    except OSError:
+                        _discard(out)
+                else:
+                    _discard(out)
+
+    return _audio_response(stream(), fmt, cached=False, upstream=response)
@@ -0,0 +1,236 @@
+# app/upstream_cache.py
+"""TTL caches for the upstream APIs, kept warm for the keys users ask for most.
+
+Every lookup is counted in a decayed frequency sketch. A background warmer
+refreshes the hottest keys shortly before their entries expire, so popular
+queries are answered from memory. Each provider has a token bucket holding its
+upstream rate budget, shared by request-time misses and the warmer; the warmer
+leaves a reserve for misses. A semaphore caps concurrent upstream calls.
+Failed fetches are cached briefly too, with a backoff that grows while a key
+keeps failing, so a bad key cannot drain the budget.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from .config import settings
+from .quotas import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_ERROR_TTL = 600.0 # Backoff cap for keys whose fetches keep failing
+
+
+class FrequencySketch:
+    """Count-min sketch whose counts halve every `half_life` seconds.
+
+    The sketch itself cannot list its keys, so the estimates of up to `max_keys`
+    recently seen keys are kept alongside it to find the hottest.
+    """
+
+    def __init__(self, width: int = 1024, depth: int = 4, half_life: float = 600.0, max_keys: int = 1000):
+        self.width = width
+        self.half_life = half_life
+        self.max_keys = max_keys
+        self.rows = [[0.0] * width for _ in range(depth)]
+        self.candidates: Dict[Hashable, float] = {}
+        self._next_decay = time.monotonic() + half_life
+
+    def _cells(self, key: Hashable) -> List[Tuple[List[float], int]]:
+        return [(row, hash((i, key)) % self.width) for i, row in enumerate(self.rows)]
+
+    def _decay(self):
+        now = time.monotonic()
+        while now >= self._next_decay:
+            for row in self.rows:
+                row[:] = [count / 2 for count in row]
+            self.candidates = {k: v / 2 for k, v in self.candidates.items() if v >= 1}
+            self._next_decay += self.half_life
+
+    def add(self, key: Hashable):
+        self._decay()
+        cells = self._cells(key)
+        # Conservative update: only raise the counters that are at the current minimum
+        estimate = min(row[i] for row, i in cells) + 1
+        for row, i in cells:
+            if row[i] < estimate:
+                row[i] = estimate
+        self.candidates[key] = estimate
+        if len(self.candidates) > self.max_keys:
+            keep = sorted(self.candidates, key=self.candidates.get, reverse=True)[:self.max_keys * 3 // 4]
+            self.candidates = {k: self.candidates[k] for k in keep}
+
+    def estimate(self, key: Hashable) -> float:
+        self._decay()
+        return min(row[i] for row, i in self._cells(key))
+
+    def hottest(self, n: int, min_count: float = 2) -> List[Hashable]:
+        self._decay()
+        ranked = sorted(self.candidates, key=self.candidates.get, reverse=True)
+        return [k for k in ranked[:n] if self.candidates[k] >= min_count]
+
+
+class UpstreamCache:
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[[Hashable], Awaitable[Any]],
+        ttl: float,
+        requests_per_minute: float,
+        max_concurrency: int = 4,
+        warm_keys: int = 20,
+        max_entries: int = 5000,
+        error_ttl: float = 30.0,
+    ):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.warm_keys = warm_keys
+        self.max_entries = max_entries
+        self.refresh_ahead = ttl * 0.2 # Refresh hot keys in the last fifth of their lifetime
+        self.entries: Dict[Hashable, Tuple[Any, float]] = {} # key -> (value, expires at)
+        self.error_ttl = error_ttl
+        self.failures: Dict[Hashable, Tuple[Exception, float, int]] = {} # key -> (error, retry at, failures in a row)
+        self.sketch = FrequencySketch(half_life=max(ttl, 300.0))
+        self.budget = TokenBucket(max(1.0, requests_per_minute), requests_per_minute / 60)
+        self.reserve = self.budget.capacity / 4 # Budget the warmer leaves for request-time misses
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "error_hits": 0, "refreshes": 0, "budget_skips": 0, "errors": 0}
+
+    async def get(self, key: Hashable) -> Any:
+        self.sketch.add(key)
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] > now:
+            self.stats["hits"] += 1
+            return entry[0]
+        failure = self.failures.get(key)
+        if failure is not None and failure[1] > now:
+            self.stats["error_hits"] += 1
+            raise failure[0]
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._load(key))
+
+    def _load(self, key: Hashable, delay: float = 0.0) -> asyncio.Task:
+        """One upstream call per key at a time; concurrent callers share it."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, delay))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch(self, key: Hashable, delay: float) -> Any:
+        if delay:
+            await asyncio.sleep(delay)
+        async with self._semaphore:
+            self.budget.charge(1)
+            try:
+                value = await self.fetch(key)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self._record_failure(key, e)
+                raise
+        self.failures.pop(key, None)
+        if len(self.entries) >= self.max_entries:
+            now = time.monotonic()
+            self.entries = {k: v for k, v in self.entries.items() if v[1] > now}
+            if len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        return value
+
+    def _record_failure(self, key: Hashable, error: Exception):
+        now = time.monotonic()
+        if len(self.failures) >= self.max_entries:
+            self.failures = {k: v for k, v in self.failures.items() if v[1] > now}
+        streak = self.failures[key][2] + 1 if key in self.failures else 1
+        self.failures[key] = (error, now + min(self.error_ttl * 2 ** min(streak - 1, 10), MAX_ERROR_TTL), streak)
+
+    def due(self) -> List[Hashable]:
+        """Hot keys that are missing or expire within the refresh window, unless they failed recently."""
+        now = time.monotonic()
+        deadline = now + self.refresh_ahead
+        return [
+            key for key in self.sketch.hottest(self.warm_keys)
+            if key not in self._inflight
+            and (key not in self.entries or self.entries[key][1] <= deadline)
+            and not (key in self.failures and self.failures[key][1] > now)
+        ]
+
+    def warm(self, spread: float) -> List[asyncio.Task]:
+        """Start refreshes for due keys, each delayed by up to `spread` seconds of jitter.
+
+        The jitter stays within the first half of an entry's remaining lifetime, so a
+        request never has to wait on a sleeping refresh; missing or expired keys are
+        fetched at once.
+        """
+        tasks = []
+        now = time.monotonic()
+        for key in self.due():
+            if self.budget.remaining() - len(tasks) <= self.reserve:
+                self.stats["budget_skips"] += 1
+                break
+            self.stats["refreshes"] += 1
+            remaining = self.entries[key][1] - now if key in self.entries else 0.0
+            tasks.append(self._load(key, delay=random.uniform(0, min(spread, remaining / 2)) if remaining > 0 else 0.0))
+        return tasks
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "entries": len(self.entries),
+            "failing_keys": len(self.failures),
+            "budget_remaining": round(self.budget.remaining(), 2),
+            "hot_keys": [str(k) for k in self.sketch.hottest(self.warm_keys)],
+        }
+
+
+class CacheWarmer:
+    """Periodically refreshes the hot keys of every registered cache."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.caches: Dict[str, UpstreamCache] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._refreshes: Set[asyncio.Task] = set()
+
+    def register(self, cache: UpstreamCache) -> UpstreamCache:
+        self.caches[cache.name] = cache
+        return cache
+
+    def warm_once(self):
+        for cache in self.caches.values():
+            # Jitter spreads the refreshes over most of the interval instead of bursting them
+            for task in cache.warm(spread=min(self.interval, cache.refresh_ahead) * 0.8):
+                self._refreshes.add(task)
+                task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Cache refresh failed: {task.exception()}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
+            self.warm_once()
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._refreshes):
+            task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: cache.snapshot() for name, cache in self.caches.items()}
+
+
+cache_warmer = CacheWarmer(settings.CACHE_WARM_INTERVAL)
@@ -1,27 +1,31 @@
 # backend/app/weather.py
 import os
-import requests
-from fastapi import APIRouter, HTTPException
+import httpx
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
+from .http_cache import json_response
+from .upstream_cache import UpstreamCache, cache_warmer
 
 router = APIRouter()
 
-class LocationRequest(BaseModel):
-    city: str
-    country_code: str = ""  # Optional, default empty
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "http://api.openweathermap.org")
+# OpenWeather refreshes current conditions about every 10 minutes
+WEATHER_CACHE_CONTROL = os.getenv("WEATHER_CACHE_CONTROL", "public, max-age=300, stale-while-revalidate=300")
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+# Upstream budget shared by cache misses and the warmer (the OpenWeather free tier allows 60/min)
+WEATHER_RATE_PER_MINUTE = float(os.getenv("WEATHER_RATE_PER_MINUTE", "50"))
+WEATHER_MAX_CONCURRENCY = int(os.getenv("WEATHER_MAX_CONCURRENCY", "4"))
 
-@router.post("/weather/")
-async def get_weather(location: LocationRequest):
-    API_KEY = os.getenv("OPENWEATHER_API_KEY")
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="Weather API key not configured")
-    
-    # Combine city and country if provided
-    city_query = f"{location.city},{location.country_code}" if location.country_code else location.city
+_client = httpx.AsyncClient(timeout=10.0)
 
+async def fetch_weather(city_query: str) -> dict:
+    """Current weather for a normalized "city[,country]" query, straight from OpenWeather"""
+    API_KEY = os.getenv("OPENWEATHER_API_KEY")
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city_query}&appid={API_KEY}&units=metric"
-        response = requests.get(url)
+        response = await _client.get(
+            f"{OPENWEATHER_BASE_URL}/data/2.5/weather",
+            params={"q": city_query, "appid": API_KEY, "units": "metric"},
+        )
         response.raise_for_status()
 
         data = response.json()
@@ -33,9 +37,35 @@ async def get_weather(location: LocationRequest):
             "wind_speed": data["wind"]["speed"]
         }
 
-    except requests.exceptions.HTTPError as http_err:
-        if response.status_code == 404:
+    except httpx.HTTPStatusError as http_err:
+        if http_err.response.status_code == 404:
             raise HTTPException(status_code=404, detail="City not found")
-        raise HTTPException(status_code=response.status_code, detail=f"HTTP error: {http_err}")
+        raise HTTPException(status_code=http_err.response.status_code, detail=f"HTTP error: {http_err}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Weather data unavailable: {str(e)}")
+
+weather_cache = cache_warmer.register(UpstreamCache(
+    "openweather", fetch_weather, WEATHER_CACHE_TTL, WEATHER_RATE_PER_MINUTE, WEATHER_MAX_CONCURRENCY
+))
+
+class LocationRequest(BaseModel):
+    city: str
+    country_code: str = ""  # Optional, default empty
+
+@router.post("/weather/")
+async def get_weather(location: LocationRequest):
+    API_KEY = os.getenv("OPENWEATHER_API_KEY")
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="Weather API key not configured")
+    
+    # Combine city and country if provided
+    city_query = f"{location.city},{location.country_code}" if location.country_code else location.city
+
+    # Normalized so "Paris" and " paris" share one cache entry and one frequency count
+    return await weather_cache.get(city_query.strip().lower())
+
+@router.get("/weather/")
+async def read_weather(request: Request, city: str, country_code: str = ""):
+    """Cacheable variant of POST /weather/ with ETag and Cache-Control headers"""
+    data = await get_weather(LocationRequest(city=city, country_code=country_code))
+    return json_response(request, data, WEATHER_CACHE_CONTROL)
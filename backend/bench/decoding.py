@@ -0,0 +1,110 @@
+# bench/decoding.py
+"""Compare standard and speculative decoding on a real GGUF model.
+
+Each prompt is generated at temperature 0 with and without the draft model on
+the same Llama instance. The report contains tokens/sec for both paths, the
+estimated draft acceptance rate and whether the two outputs are identical.
+
+    cd backend && python -m bench.decoding --model app/models/llama-2-7b-chat.Q4_K_M.gguf --draft-mode prompt_lookup
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+# Skip the module-level engine in app.llama_engine; this script loads its own
+os.environ["LLAMA_MODEL_PATH"] = ""
+
+from app.llama_engine import EnhancedLlama
+from app.speculative import DRAFT_MODES, acceptance_rate
+
+DEFAULT_PROMPTS = [
+    "Repeat the following list exactly, then add one more item: apples, bananas, cherries, dates, elderberries, figs.",
+    "Rewrite this sentence in the past tense: The assistant reads the weather report and tells the user what to wear.",
+    "Write a Python function that returns the factorial of n, with a docstring.",
+    "Summarize in two sentences: Speculative decoding drafts several tokens cheaply and lets the large model verify them in one batch.",
+    "Give me three tips for better sleep.",
+]
+
+
+def run_once(engine: EnhancedLlama, prompt: str, max_tokens: int, speculative: bool) -> Dict:
+    engine.llm.reset() # Drop the cached prompt so both paths pay the same prefill
+    before = engine.decoding_stats() if speculative else None
+    started = time.perf_counter()
+    response = engine.create_completion(
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        temperature=0.0,
+        speculative=speculative,
+    )
+    elapsed = time.perf_counter() - started
+    completion_tokens = response["usage"]["completion_tokens"]
+    result = {
+        "text": response["choices"][0]["message"]["content"],
+        "completion_tokens": completion_tokens,
+        "seconds": round(elapsed, 3),
+        "tokens_per_sec": round(completion_tokens / elapsed, 2) if elapsed else 0.0,
+    }
+    if speculative:
+        result["acceptance_rate"] = acceptance_rate(completion_tokens, before, engine.decoding_stats())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative vs standard decoding")
+    parser.add_argument("--model", required=True, help="main GGUF model path")
+    parser.add_argument("--draft-mode", default="prompt_lookup", choices=[m for m in DRAFT_MODES if m != "off"])
+    parser.add_argument("--draft-model", help="draft GGUF path (draft_model mode)")
+    parser.add_argument("--draft-tokens", type=int, help="tokens drafted per step")
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--prompts", help="file with one prompt per line (default: built-in set)")
+    parser.add_argument("--output", default="bench_decoding.json", help="JSON output path ('-' for stdout only)")
+    args = parser.parse_args()
+
+    prompts = Path(args.prompts).read_text().splitlines() if args.prompts else DEFAULT_PROMPTS
+    engine = EnhancedLlama(
+        model_path=args.model,
+        draft_mode=args.draft_mode,
+        draft_model_path=args.draft_model,
+        draft_tokens=args.draft_tokens,
+    )
+
+    runs = []
+    for prompt in filter(None, prompts):
+        standard = run_once(engine, prompt, args.max_tokens, speculative=False)
+        speculative = run_once(engine, prompt, args.max_tokens, speculative=True)
+        runs.append({
+            "prompt": prompt,
+            "identical_output": standard.pop("text") == speculative.pop("text"),
+            "standard": standard,
+            "speculative": speculative,
+            "speedup": round(speculative["tokens_per_sec"] / standard["tokens_per_sec"], 3) if standard["tokens_per_sec"] else None,
+        })
+
+    def total_tps(key):
+        tokens = sum(r[key]["completion_tokens"] for r in runs)
+        seconds = sum(r[key]["seconds"] for r in runs)
+        return round(tokens / seconds, 2) if seconds else 0.0
+
+    rates = [r["speculative"]["acceptance_rate"] for r in runs if r["speculative"]["acceptance_rate"] is not None]
+    report = {
+        "config": {"model": args.model, "draft_mode": args.draft_mode, "draft_model": args.draft_model,
+                   "draft_tokens": args.draft_tokens, "max_tokens": args.max_tokens},
+        "summary": {
+            "standard_tokens_per_sec": total_tps("standard"),
+            "speculative_tokens_per_sec": total_tps("speculative"),
+            "mean_acceptance_rate": round(sum(rates) / len(rates), 3) if rates else None,
+            "all_outputs_identical": all(r["identical_output"] for r in runs),
+        },
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output != "-":
+        Path(args.output).write_text(text)
+
+
+if __name__ == "__main__":
+    main()
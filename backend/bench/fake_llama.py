@@ -0,0 +1,138 @@
+# bench/fake_llama.py
+"""Deterministic stand-in for llama_cpp.Llama.
+
+Produces the same completion for the same prompt and simulates CPU cost with a
+configurable per-token sleep, so load tests are reproducible without a model file.
+When a grammar is passed (the tool-call step) it emits tool-call JSON derived
+from simple rules on the user message, standing in for a grammar-constrained model.
+"""
+import hashlib
+import json
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+WORDS = [
+    "the", "assistant", "can", "help", "with", "your", "question", "about",
+    "today", "weather", "news", "tasks", "and", "more", "sure", "here",
+    "is", "a", "short", "answer", "that", "should", "be", "useful",
+]
+
+
+class FakeLlama:
+    def __init__(
+        self,
+        token_latency: float = 0.02,
+        prompt_token_latency: float = 0.0005,
+        n_ctx: int = 2048,
+        completion_tokens: Optional[int] = None,
+    ):
+        self.token_latency = token_latency  # Seconds per generated token (decode)
+        self.prompt_token_latency = prompt_token_latency  # Seconds per prompt token (prefill)
+        self._n_ctx = n_ctx
+        self.completion_tokens = completion_tokens  # Fixed length; None -> derived from prompt
+        self.model_path = "fake.gguf"
+        self.draft_model = None
+        self.n_tokens = 0 # Tokens evaluated in the context, as on llama_cpp.Llama
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    # --- Tokenizer (one token per whitespace-separated word) ---
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [self._word_id(w) for w in text.decode("utf-8", errors="ignore").split()]
+        return ([1] if add_bos else []) + tokens
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return " ".join(WORDS[t % len(WORDS)] for t in tokens if t != 1).encode()
+
+    @staticmethod
+    def _word_id(word: str) -> int:
+        return 2 + int(hashlib.md5(word.encode()).hexdigest()[:6], 16) % 30000
+
+    # --- Generation ---
+    def _completion_words(self, prompt: str, max_tokens: int) -> List[str]:
+        seed = hashlib.sha256(prompt.encode()).digest()
+        length = self.completion_tokens or 16 + seed[0] % 48
+        length = min(length, max_tokens)
+        return [WORDS[seed[i % len(seed)] % len(WORDS)] for i in range(length)]
+
+    @staticmethod
+    def _prompt_text(messages: List[Dict[str, str]]) -> str:
+        return "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+
+    @staticmethod
+    def tool_calls(user_message: str) -> List[Dict[str, Any]]:
+        """Tool calls a well-behaved model would emit for `user_message`."""
+        calls = []
+        for clause in re.split(r"\band\b|[,;?]", user_message):
+            text = clause.strip().rstrip("?.!")
+            lower = text.lower()
+            location = re.search(r"\b(?:in|for|at)\s+(.+)$", text)
+            topic = re.search(r"\b(?:about|on|regarding)\s+(.+)$", text)
+            if "calculate" in lower:
+                calls.append({"tool": "calculator", "arguments": {"expression": lower.split("calculate", 1)[1].strip()}})
+            elif any(w in lower for w in ("weather", "temperature", "forecast")) and location:
+                calls.append({"tool": "weather", "arguments": {"location": location.group(1).strip()}})
+            elif any(w in lower for w in ("news", "headline", "latest")):
+                calls.append({"tool": "news", "arguments": {"topic": topic.group(1).strip() if topic else "general"}})
+        return calls[:3]
+
+    def _generate(self, prompt: str, max_tokens: int, words: Optional[List[str]] = None) -> Iterator[str]:
+        # Lazy, like llama_cpp: closing the stream early stops "decoding"
+        self.n_tokens = len(self.tokenize(prompt.encode()))
+        time.sleep(self.n_tokens * self.prompt_token_latency)
+        for i, word in enumerate((words if words is not None else self._completion_words(prompt, max_tokens))[:max_tokens]):
+            if i:
+                self.n_tokens += 1 # The previous word is evaluated before this one is sampled
+            time.sleep(self.token_latency)
+            yield word
+
+    def create_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stream: bool = False,
+        grammar=None,
+    ):
+        prompt = self._prompt_text(messages)
+        prompt_tokens = len(self.tokenize(prompt.encode()))
+        tool_words = None
+        if grammar is not None:
+            user_message = next(m["content"] for m in reversed(messages) if m["role"] == "user")
+            tool_words = json.dumps({"calls": self.tool_calls(user_message)}).split(" ")
+        words = self._generate(prompt, max_tokens or 256, tool_words)
+
+        if stream:
+            return self._stream_chunks(words)
+
+        text = " ".join(words)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": self.model_path,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(text.split()),
+                "total_tokens": prompt_tokens + len(text.split()),
+            },
+        }
+
+    def _stream_chunks(self, words: Iterator[str]):
+        # Like llama_cpp, the role chunk is sent together with the first completion chunk
+        role = {"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+        first = True
+        for word in words:
+            if first:
+                yield role
+            yield {"choices": [{"index": 0, "delta": {"content": word if first else f" {word}"}, "finish_reason": None}]}
+            first = False
+        if first:
+            yield role
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
@@ -0,0 +1,330 @@
+# bench/run.py
+"""Offline end-to-end load benchmark.
+
+Starts the stub upstream server, launches the API with the fake Llama in a
+subprocess, drives a mixed workload at a fixed concurrency and writes
+latency percentiles, throughput and error rates as JSON.
+
+    cd backend && python -m bench.run --concurrency 16 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from bench.stubs import StubServer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_MIX = "chat=35,tools=20,auth=10,tasks=20,history=10,tts=5"
+
+CHAT_PROMPTS = [
+    "Tell me a fun fact about octopuses",
+    "How should I plan my week?",
+    "Write a haiku about coffee",
+    "Explain what an API is in simple terms",
+    "Give me three tips for better sleep",
+]
+TOOL_PROMPTS = [
+    "What's the weather in London?",
+    "weather in Paris",
+    "Show me the latest news about technology",
+    "Any headlines on sports?",
+    "calculate 12 * (4 + 3)",
+    "calculate 1024 / 16",
+    "weather in Paris and news about France",
+]
+
+
+# --- Workload operations: each returns (op_name, ok) ---
+
+async def op_chat(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    return await _chat(client, user, rng.choice(CHAT_PROMPTS), "chat")
+
+
+async def op_tools(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    return await _chat(client, user, rng.choice(TOOL_PROMPTS), "tools")
+
+
+async def _chat(client, user, prompt, name):
+    r = await client.post("/chat/", json={"prompt": prompt}, headers=user["headers"])
+    # /chat/ reports failures as {"error": ...} with a 200 status
+    return name, r.status_code == 200 and "response" in r.json()
+
+
+async def op_heavy(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    """Long prompt, as sent back-to-back by a heavy user."""
+    prompt = " ".join(rng.choice(CHAT_PROMPTS) for _ in range(60))
+    r = await client.post("/chat/", json={"prompt": prompt}, headers=user["headers"])
+    return "heavy", r.status_code == 200 and "response" in r.json()
+
+
+async def op_abandon(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    """Start a chat and hang up before the answer arrives (closed tab / client retry)."""
+    try:
+        await client.post("/chat/", json={"prompt": rng.choice(CHAT_PROMPTS)}, headers=user["headers"], timeout=0.3)
+    except httpx.TimeoutException:
+        return "abandon", True
+    return "abandon", True
+
+
+async def op_auth(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    r = await client.post("/login/", json={"username": user["username"], "password": user["password"]})
+    return "auth", r.status_code == 200
+
+
+async def op_tasks(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    if rng.random() < 0.3:
+        r = await client.post("/add_task/", json={"task_name": f"task {rng.randint(0, 9999)}"}, headers=user["headers"])
+        return "tasks.add", r.status_code == 200
+    r = await client.get("/get_tasks/", headers=user["headers"])
+    return "tasks.get", r.status_code == 200
+
+
+async def op_history(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    if rng.random() < 0.3:
+        r = await client.post(
+            "/save_conversation/",
+            json={"message": rng.choice(CHAT_PROMPTS), "response": "stub response"},
+            headers=user["headers"],
+        )
+        return "history.save", r.status_code == 200
+    r = await client.get("/get_conversations/", headers=user["headers"])
+    return "history.get", r.status_code == 200
+
+
+async def op_tts(client: httpx.AsyncClient, user: Dict, rng: random.Random):
+    r = await client.post("/tts", json={"text": rng.choice(CHAT_PROMPTS)})
+    return "tts", r.status_code == 200 and len(r.content) > 0
+
+
+OPERATIONS = {
+    "chat": op_chat,
+    "tools": op_tools,
+    "abandon": op_abandon,
+    "auth": op_auth,
+    "tasks": op_tasks,
+    "history": op_history,
+    "tts": op_tts,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown workload '{name}'. Choose from: {sorted(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], errors: int, window: float) -> Dict[str, float]:
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "throughput_rps": round(count / window, 3) if window else 0.0,
+        "mean_ms": round(sum(values) / count * 1000, 2) if count else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if count else 0.0,
+    }
+
+
+# --- Server lifecycle ---
+
+def start_api(port: int, stub_url: str, db_path: str, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SECRET_KEY": "bench-secret",
+        "ALGORITHM": "HS256",
+        "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+        "ELEVEN_API_KEY": "bench",
+        "OPENWEATHER_API_KEY": "bench",
+        "NEWS_API_KEY": "bench",
+        "OPENWEATHER_BASE_URL": stub_url,
+        "NEWS_API_BASE_URL": stub_url,
+        "ELEVEN_BASE_URL": stub_url,
+        "ASSISTANT_API_URL": f"http://127.0.0.1:{port}",
+        "LLAMA_MODEL_PATH": "",  # Never load a real model; bench.serve installs the fake
+        "LLAMA_TOOL_MODE": args.tool_mode,
+    })
+    cmd = [
+        sys.executable, "-m", "bench.serve",
+        "--port", str(port),
+        "--token-latency", str(args.token_latency),
+        "--prompt-token-latency", str(args.prompt_token_latency),
+    ]
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+
+
+async def wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"API process exited with code {proc.returncode}")
+            try:
+                if (await client.get("/openapi.json")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"API did not become ready at {base_url}")
+
+
+async def create_users(client: httpx.AsyncClient, count: int, run_id: str) -> List[Dict]:
+    users = []
+    for i in range(count):
+        username = f"bench_{run_id}_{i}"
+        password = "bench-password"
+        r = await client.post("/register/", json={"username": username, "email": f"{username}@example.com", "password": password})
+        r.raise_for_status()
+        r = await client.post("/login/", json={"username": username, "password": password})
+        r.raise_for_status()
+        token = r.json()["access_token"]
+        users.append({"username": username, "password": password, "headers": {"Authorization": f"Bearer {token}"}})
+    return users
+
+
+# --- Load generation ---
+
+async def run_load(base_url: str, users: List[Dict], weights: Dict[str, float], args) -> Dict:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    names, mix_weights = list(weights), list(weights.values())
+    timeout = httpx.Timeout(args.request_timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        stop_at = time.monotonic() + args.warmup + args.duration
+        measure_from = time.monotonic() + args.warmup
+
+        async def worker(idx: int):
+            rng = random.Random(args.seed + idx)
+            # The first --heavy-workers workers share users[0] and only send long prompts
+            heavy = idx < args.heavy_workers
+            light_users = users[1:] if args.heavy_workers else users
+            user = users[0] if heavy else light_users[idx % len(light_users)]
+            while time.monotonic() < stop_at:
+                op = op_heavy if heavy else OPERATIONS[rng.choices(names, weights=mix_weights)[0]]
+                started = time.monotonic()
+                try:
+                    name, ok = await op(client, user, rng)
+                except (httpx.HTTPError, ValueError):
+                    name, ok = op.__name__[3:], False
+                if started < measure_from:
+                    continue
+                latencies[name].append(time.monotonic() - started)
+                if not ok:
+                    errors[name] += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency + args.heavy_workers)))
+        elapsed = time.monotonic() - started - args.warmup # Includes draining requests still running at stop_at
+
+    # Throughput is over the measurement window: operations started in it, per second of it
+    all_latencies = [v for values in latencies.values() for v in values]
+    return {
+        "overall": summarize(all_latencies, sum(errors.values()), args.duration),
+        "operations": {name: summarize(latencies[name], errors[name], args.duration) for name in sorted(latencies)},
+        "window_s": args.duration,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+async def main_async(args) -> Dict:
+    weights = parse_mix(args.mix)
+    stub = StubServer(port=args.stub_port).start()
+    db_dir = tempfile.mkdtemp(prefix="assistant-bench-")
+    proc = start_api(args.port, stub.url, os.path.join(db_dir, "bench.db"), args)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        await wait_ready(base_url, proc)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+            count = (args.users or args.concurrency) + (1 if args.heavy_workers else 0)
+            users = await create_users(client, count, str(int(time.time())))
+        results = await run_load(base_url, users, weights, args)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+            await asyncio.sleep(1.0) # Let abandoned generations notice the disconnect
+            results["llm"] = (await client.get("/llm/stats")).json()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        stub.stop()
+
+    return {
+        "config": {
+            "concurrency": args.concurrency,
+            "heavy_workers": args.heavy_workers,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": weights,
+            "token_latency_s": args.token_latency,
+            "prompt_token_latency_s": args.prompt_token_latency,
+            "seed": args.seed,
+            "tool_mode": args.tool_mode,
+        },
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "upstream_calls": dict(stub.app.state.calls),
+        **results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the assistant API")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of load discarded before measuring")
+    parser.add_argument("--heavy-workers", type=int, default=0,
+                        help="extra workers sending long prompts as a single heavy user")
+    parser.add_argument("--users", type=int, default=0, help="distinct users (default: one per worker)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted workload mix (default: {DEFAULT_MIX})")
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0005)
+    parser.add_argument("--tool-mode", default="keywords", choices=["keywords", "grammar"])
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--stub-port", type=int, default=8901)
+    parser.add_argument("--output", default="bench_results.json", help="JSON output path ('-' for stdout only)")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output != "-":
+        Path(args.output).write_text(text)
+
+
+if __name__ == "__main__":
+    main()
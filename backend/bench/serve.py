@@ -0,0 +1,40 @@
+# bench/serve.py
+"""Run the FastAPI app with the fake Llama installed.
+
+Started as a subprocess by bench.run; the environment (DATABASE_URL, upstream
+base URLs, API keys) is prepared by the caller.
+"""
+import argparse
+
+import uvicorn
+
+from bench.fake_llama import FakeLlama
+
+
+def install_engine(engine):
+    """Replace the module-level LLM engine everywhere it has been imported."""
+    from app import llama_engine, main
+
+    llama_engine.llm_engine = engine
+    main.llm_engine = engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the assistant API with a fake Llama model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds per generated token")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0005, help="seconds per prompt token")
+    args = parser.parse_args()
+
+    from app.llama_engine import EnhancedLlama
+    from app.main import app
+
+    fake = FakeLlama(token_latency=args.token_latency, prompt_token_latency=args.prompt_token_latency)
+    install_engine(EnhancedLlama(model_path=fake.model_path, llm=fake))
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# bench/stubs.py
+"""Local stand-ins for OpenWeather, NewsAPI and ElevenLabs.
+
+All three providers are served from one app; point OPENWEATHER_BASE_URL,
+NEWS_API_BASE_URL and ELEVEN_BASE_URL at it. Responses are deterministic and
+each route sleeps for a configurable latency to mimic the upstream round-trip.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+# Simulated upstream latency in seconds, per provider
+LATENCY = {"weather": 0.08, "news": 0.15, "tts": 0.25}
+
+# Fake audio payload size per TTS request
+AUDIO_BYTES = 32 * 1024
+AUDIO_CHUNK = 4096
+
+
+def _seed(*parts: str) -> bytes:
+    return hashlib.sha256("|".join(parts).encode()).digest()
+
+
+def create_stub_app() -> FastAPI:
+    app = FastAPI()
+    app.state.calls = {"weather": 0, "news": 0, "tts": 0}
+
+    @app.get("/data/2.5/weather")
+    async def weather(q: str, appid: str = "", units: str = "metric"):
+        app.state.calls["weather"] += 1
+        await asyncio.sleep(LATENCY["weather"])
+        city = q.split(",")[0]
+        seed = _seed("weather", city.lower())
+        return {
+            "name": city.title(),
+            "sys": {"country": "XX"},
+            "main": {"temp": round(seed[0] / 8 - 5, 1), "humidity": seed[1] % 100},
+            "weather": [{"description": ["clear sky", "light rain", "overcast clouds", "snow"][seed[2] % 4]}],
+            "wind": {"speed": round(seed[3] / 20, 1)},
+        }
+
+    @app.get("/v2/top-headlines")
+    async def headlines(country: str = "us", category: str = "general", apiKey: str = "", q: str = ""):
+        app.state.calls["news"] += 1
+        await asyncio.sleep(LATENCY["news"])
+        return {
+            "status": "ok",
+            "articles": [
+                {
+                    "title": f"{category.title()} headline {i} ({country})",
+                    "source": {"name": f"Stub Source {i}"},
+                    "url": f"https://example.com/{country}/{category}/{i}",
+                    "publishedAt": f"2024-01-0{i + 1}T00:00:00Z",
+                }
+                for i in range(5)
+            ],
+        }
+
+    async def _audio(voice_id: str, request: Request):
+        app.state.calls["tts"] += 1
+        await asyncio.sleep(LATENCY["tts"])
+        body = await request.body()
+        block = _seed("tts", voice_id, body.decode(errors="ignore"))
+        audio = (block * (AUDIO_BYTES // len(block) + 1))[:AUDIO_BYTES]
+
+        async def chunks():
+            for i in range(0, len(audio), AUDIO_CHUNK):
+                yield audio[i:i + AUDIO_CHUNK]
+
+        return StreamingResponse(chunks(), media_type="audio/mpeg")
+
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def tts(voice_id: str, request: Request):
+        return await _audio(voice_id, request)
+
+    @app.post("/v1/text-to-speech/{voice_id}/stream")
+    async def tts_stream(voice_id: str, request: Request):
+        return await _audio(voice_id, request)
+
+    @app.get("/healthz")
+    async def healthz():
+        return Response(status_code=204)
+
+    return app
+
+
+class StubServer:
+    """Runs the stub app with uvicorn in a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8901):
+        self.app = create_stub_app()
+        self.url = f"http://{host}:{port}"
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def start(self, timeout: float = 10.0) -> "StubServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Stub server did not start on {self.url}")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
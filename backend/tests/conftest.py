@@ -0,0 +1,7 @@
+# tests/conftest.py
+# Lets `pytest` run from the repo root or backend/ and import `app` and `bench`
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LLAMA_MODEL_PATH", "") # Tests build engines around FakeLlama
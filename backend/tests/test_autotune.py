@@ -0,0 +1,55 @@
+# tests/test_autotune.py
+"""Physical core detection under CPU affinity."""
+import io
+import os
+import sys
+
+import pytest
+
+from app import autotune
+
+
+def cpuinfo(*cpus):
+    """/proc/cpuinfo text for (processor, physical id, core id) triples."""
+    return "\n\n".join(
+        f"processor\t: {p}\nmodel name\t: Test CPU\nphysical id\t: {socket}\ncore id\t\t: {core}\n"
+        for p, socket, core in cpus
+    ) + "\n"
+
+
+# 8 logical CPUs on one socket: 4 cores, each with SMT siblings n and n + 4
+SMT_HOST = cpuinfo(*[(p, 0, p % 4) for p in range(8)])
+
+
+@pytest.fixture
+def host(monkeypatch):
+    def configure(text, affinity):
+        monkeypatch.setattr(autotune, "open", lambda *args, **kwargs: io.StringIO(text), raising=False)
+        monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(affinity), raising=False)
+    return configure
+
+
+def test_all_cpus_allowed(host):
+    host(SMT_HOST, range(8))
+    assert autotune.physical_core_count() == 4
+
+
+def test_cpuset_of_two_smt_pairs(host):
+    host(SMT_HOST, {0, 4, 1, 5})
+    assert autotune.physical_core_count() == 2
+
+
+def test_cpuset_of_distinct_cores(host):
+    host(SMT_HOST, {0, 1, 2, 3})
+    assert autotune.physical_core_count() == 4
+
+
+def test_sockets_are_distinguished(host):
+    host(cpuinfo((0, 0, 0), (1, 1, 0), (2, 0, 1), (3, 1, 1)), range(4))
+    assert autotune.physical_core_count() == 4
+
+
+def test_no_topology_falls_back_to_logical_count(host, monkeypatch):
+    monkeypatch.setitem(sys.modules, "psutil", None) # Import fails, as without psutil
+    host("processor\t: 0\n\nprocessor\t: 1\n", {0, 1})
+    assert autotune.physical_core_count() == 2
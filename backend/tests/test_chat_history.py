@@ -0,0 +1,51 @@
+# tests/test_chat_history.py
+"""Fitting WebSocket chat history into the model's context window."""
+from app.llama_engine import CHAT_MAX_TOKENS, TEMPLATE_TOKENS_PER_MESSAGE, EnhancedLlama
+from bench.fake_llama import FakeLlama
+
+
+def make_engine(n_ctx):
+    return EnhancedLlama(model_path="", llm=FakeLlama(n_ctx=n_ctx))
+
+
+def turns(count, words):
+    history = []
+    for i in range(count):
+        history += [
+            {"role": "user", "content": f"question {i} " + "word " * words},
+            {"role": "assistant", "content": f"answer {i} " + "word " * words},
+        ]
+    return history
+
+
+def test_short_history_is_kept():
+    history = turns(3, 5)
+    assert make_engine(2048).fit_history(history, "hello", "keywords") == history
+
+
+def test_oldest_turns_are_dropped_first():
+    history = turns(6, 60)
+    fitted = make_engine(512).fit_history(history, "hello", "keywords")
+    assert 0 < len(fitted) < len(history)
+    assert len(fitted) % 2 == 0 and fitted[0]["role"] == "user"
+    assert fitted == history[-len(fitted):]
+    used = sum(len(m["content"].split()) + TEMPLATE_TOKENS_PER_MESSAGE for m in fitted)
+    assert used + CHAT_MAX_TOKENS <= 512
+
+
+def test_long_prompt_leaves_less_room():
+    engine = make_engine(1024)
+    history = turns(6, 40)
+    short = engine.fit_history(history, "hello", "keywords")
+    long = engine.fit_history(history, "please " * 300, "keywords")
+    assert len(long) < len(short)
+
+
+def test_grammar_mode_keeps_room_for_tool_results():
+    engine = make_engine(1024)
+    history = turns(6, 40)
+    assert len(engine.fit_history(history, "hello", "grammar")) < len(engine.fit_history(history, "hello", "keywords"))
+
+
+def test_prompt_larger_than_context_drops_everything():
+    assert make_engine(256).fit_history(turns(2, 5), "word " * 400, "keywords") == []
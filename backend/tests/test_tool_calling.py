@@ -0,0 +1,190 @@
+# tests/test_tool_calling.py
+"""Grammar-mode tool calling, driven end to end by the benchmark's FakeLlama."""
+import asyncio
+import json
+
+import pytest
+
+from app import llama_engine
+from app.llama_engine import MAX_TOOL_CALLS, EnhancedLlama
+from bench.fake_llama import FakeLlama
+
+parse = EnhancedLlama._parse_tool_calls
+
+
+def calls_json(*calls):
+    return json.dumps({"calls": [{"tool": tool, "arguments": args} for tool, args in calls]})
+
+
+# --- _parse_tool_calls ---
+@pytest.mark.parametrize("text", [
+    "",
+    "sure, let me check the weather",
+    '{"calls": [{"tool": "weather", "arguments": {"location": "Par',  # Truncated at max_tokens
+    '[{"tool": "weather"}]',
+    '{"tool": "weather"}',
+    '{"calls": {"tool": "weather"}}',
+])
+def test_parse_rejects_malformed_output(text):
+    assert parse(text) is None
+
+
+def test_parse_drops_unknown_tools_and_bad_arguments():
+    text = json.dumps({"calls": [
+        {"tool": "email", "arguments": {"to": "me"}},
+        {"tool": "weather", "arguments": {"city": "Paris"}},
+        {"tool": "weather", "arguments": {"location": "   "}},
+        {"tool": "news", "arguments": {"topic": 42}},
+        {"tool": "news"},
+        "weather",
+        {"tool": "calculator", "arguments": {"expression": "2+2"}},
+    ]})
+    assert parse(text) == []
+
+
+def test_parse_keeps_valid_calls():
+    text = calls_json(("weather", {"location": "Paris"}), ("email", {"to": "me"}), ("news", {"topic": "France"}))
+    assert parse(text) == [
+        {"tool": "weather", "arguments": {"location": "Paris"}},
+        {"tool": "news", "arguments": {"topic": "France"}},
+    ]
+
+
+def test_parse_dedupes_calls_case_insensitively():
+    text = calls_json(("weather", {"location": "Paris"}), ("weather", {"location": "paris"}), ("news", {"topic": "Paris"}))
+    assert parse(text) == [
+        {"tool": "weather", "arguments": {"location": "Paris"}},
+        {"tool": "news", "arguments": {"topic": "Paris"}},
+    ]
+
+
+def test_parse_caps_number_of_calls():
+    cities = ["Paris", "Rome", "Oslo", "Lima", "Cairo"]
+    calls = parse(calls_json(*(("weather", {"location": city}) for city in cities)))
+    assert [c["arguments"]["location"] for c in calls] == cities[:MAX_TOOL_CALLS]
+
+
+def test_parse_empty_call_list():
+    assert parse('{"calls": []}') == []
+
+
+# --- End to end with FakeLlama ---
+class GarbledLlama(FakeLlama):
+    """Ignores the grammar, like a model whose constrained pass went wrong."""
+
+    def create_chat_completion(self, messages, max_tokens=256, temperature=0.2, stream=False, grammar=None):
+        return super().create_chat_completion(messages, max_tokens, temperature, stream)
+
+
+def make_engine(llm_class=FakeLlama):
+    engine = EnhancedLlama(model_path="", llm=llm_class(token_latency=0, prompt_token_latency=0))
+    engine.tool_mode = "grammar"
+    return engine
+
+
+def stub_fetchers(engine, on_fetch=None):
+    """Replace the HTTP tool fetchers; returns the list of calls they receive."""
+    fetched = []
+
+    async def fetch(tool, argument):
+        fetched.append((tool, argument))
+        if on_fetch is not None:
+            await on_fetch()
+        return f"{tool} for {argument}"
+
+    engine._fetch_weather = lambda location: fetch("weather", location)
+    engine._fetch_news = lambda topic: fetch("news", topic)
+    return fetched
+
+
+def test_independent_calls_run_concurrently():
+    async def scenario():
+        engine = make_engine()
+        both_started = asyncio.Event()
+        started = 0
+
+        async def on_fetch():
+            # Each fetch waits for the other, so this only completes if they overlap
+            nonlocal started
+            started += 1
+            if started == 2:
+                both_started.set()
+            await asyncio.wait_for(both_started.wait(), timeout=5)
+
+        fetched = stub_fetchers(engine, on_fetch)
+        tools = []
+        answer = await engine.generate_response(
+            "weather in Paris and news about France",
+            on_tool=lambda name, arguments, result: tools.append((name, arguments, result)),
+        )
+        return fetched, tools, answer
+
+    fetched, tools, answer = asyncio.run(scenario())
+    assert sorted(fetched) == [("news", "France"), ("weather", "Paris")]
+    assert tools == [
+        ("weather", {"location": "Paris"}, "weather for Paris"),
+        ("news", {"topic": "France"}, "news for France"),
+    ]
+    assert answer
+
+
+def test_failed_tool_is_reported_not_raised():
+    async def scenario():
+        engine = make_engine()
+        stub_fetchers(engine)
+
+        async def broken(location):
+            raise RuntimeError("upstream down")
+
+        engine._fetch_weather = broken
+        tools = []
+        await engine.generate_response(
+            "weather in Paris and news about France",
+            on_tool=lambda name, arguments, result: tools.append((name, result)),
+        )
+        return tools
+
+    assert asyncio.run(scenario()) == [("weather", "Error: upstream down"), ("news", "news for France")]
+
+
+def test_unparseable_plan_falls_back_to_keywords():
+    async def scenario():
+        engine = make_engine(GarbledLlama)
+        fetched = stub_fetchers(engine)
+        tools = []
+        answer = await engine.generate_response(
+            "what is the weather in London",
+            on_tool=lambda name, arguments, result: tools.append((name, arguments, result)),
+        )
+        return fetched, tools, answer
+
+    fetched, tools, answer = asyncio.run(scenario())
+    assert fetched == [("weather", "London")]
+    assert tools == [("weather", {}, "weather for London")]
+    assert answer == "weather for London"
+
+
+def test_truncated_plan_falls_back_to_keywords(monkeypatch):
+    monkeypatch.setattr(llama_engine, "TOOL_CALL_MAX_TOKENS", 3)
+
+    async def scenario():
+        engine = make_engine()
+        fetched = stub_fetchers(engine)
+        answer = await engine.generate_response("any news about France")
+        return fetched, answer
+
+    fetched, answer = asyncio.run(scenario())
+    assert fetched == [("news", "france")]  # The keyword path lowercases the topic
+    assert answer == "news for france"
+
+
+def test_unparseable_plan_without_keywords_answers_directly():
+    async def scenario():
+        engine = make_engine(GarbledLlama)
+        fetched = stub_fetchers(engine)
+        answer = await engine.generate_response("tell me a joke")
+        return fetched, answer
+
+    fetched, answer = asyncio.run(scenario())
+    assert fetched == []
+    assert answer
@@ -0,0 +1,31 @@
+// app/api/conditionalFetch.ts
+// GET with ETag revalidation: the last body per URL is kept, sent back as
+// If-None-Match, and reused when the backend answers 304 Not Modified.
+
+type CachedBody = { etag: string; data: unknown };
+
+const MAX_ENTRIES = 200;
+const cache = new Map<string, CachedBody>();
+
+export async function fetchJsonWithEtag(url: string): Promise<{ ok: boolean; status: number; data: any }> {
+  const cached = cache.get(url);
+  const response = await fetch(url, {
+    headers: cached ? { 'If-None-Match': cached.etag } : {},
+    cache: 'no-store', // Revalidation is handled here, not by the Next.js data cache
+  });
+
+  if (response.status === 304 && cached) {
+    return { ok: true, status: 200, data: cached.data };
+  }
+
+  const data = await response.json();
+  const etag = response.headers.get('etag');
+  if (response.ok && etag) {
+    cache.delete(url);
+    if (cache.size >= MAX_ENTRIES) {
+      cache.delete(cache.keys().next().value as string); // Oldest entry
+    }
+    cache.set(url, { etag, data });
+  }
+  return { ok: response.ok, status: response.status, data };
+}
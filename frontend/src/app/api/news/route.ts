@@ -1,25 +1,28 @@
 // app/api/news/route.ts
 import { NextResponse } from 'next/server';
+import { fetchJsonWithEtag } from '../conditionalFetch';
 
 export async function POST(request: Request) {
   try {
     const fastApiUrl = process.env.FASTAPI_URL || 'http://localhost:8000';
     const body = await request.json();
     
-    const response = await fetch(`${fastApiUrl}/news/`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(body),
-    });
+    const params = new URLSearchParams();
+    for (const key of ['topic', 'country', 'keywords']) {
+      if (body[key]) params.append(key, body[key]);
+    }
+    for (const country of body.countries ?? []) {
+      params.append('countries', country);
+    }
+
+    // Repeated polls revalidate with the backend's ETag instead of downloading again
+    const response = await fetchJsonWithEtag(`${fastApiUrl}/news/?${params}`);
 
     if (!response.ok) {
       throw new Error('Failed to fetch news');
     }
 
-    const data = await response.json();
-    return NextResponse.json(data);
+    return NextResponse.json(response.data);
   } catch (error) {
     return NextResponse.json(
       { error: error instanceof Error ? error.message : 'Unknown error' },
@@ -1,25 +1,21 @@
 import { NextResponse } from 'next/server';
+import { fetchJsonWithEtag } from '../conditionalFetch';
 
 export async function POST(request: Request) {
   try {
     const fastApiUrl = process.env.FASTAPI_URL || 'http://localhost:8000';
     const body = await request.json();
     
-    const response = await fetch(`${fastApiUrl}/weather/`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(body),
-    });
+    const params = new URLSearchParams({ city: body.city ?? '', country_code: body.country_code ?? '' });
+
+    // Repeated polls revalidate with the backend's ETag instead of downloading again
+    const response = await fetchJsonWithEtag(`${fastApiUrl}/weather/?${params}`);
 
     if (!response.ok) {
-      const errorData = await response.json();
-      throw new Error(errorData.detail || 'Failed to fetch weather');
+      throw new Error(response.data.detail || 'Failed to fetch weather');
     }
 
-    const data = await response.json();
-    return NextResponse.json(data);
+    return NextResponse.json(response.data);
   } catch (error) {
     return NextResponse.json(
       { error: error instanceof Error ? error.message : 'Unknown error' },